@@ -0,0 +1,238 @@
+import functools
+
+
+class AnalysisPipeline():
+    """Run several analyses of the same trajectory in a single pass
+
+    Every frame is read once and handed to all registered analyses, so
+    clustering, nematic order parameter and structure factor together
+    cost the I/O of one analysis. The results are stored in the
+    ensembles as if their analysis methods had been called.
+
+    Example
+    -------
+    >>> cluster_ensemble = ClusterEnsemble(tpr, xtc, ["C1", "C2"])
+    >>> order_ensemble = OrderParameterEnsemble(tpr, xtc, ["SDS"])
+    >>> pipeline = AnalysisPipeline(cluster_ensemble, order_ensemble)
+    >>> pipeline.add_cluster_analysis(cut_off=5.0, algorithm="unionfind")
+    >>> pipeline.add_nematic_op_analysis()
+    >>> pipeline.add_structure_factor_analysis(q_max=0.5, plot_style=None)
+    >>> pipeline.run(start=100)
+    >>> cluster_ensemble.cluster_list, order_ensemble.nematic_op_list
+
+    Attributes
+    ----------
+    cluster_ensemble : ClusterEnsemble or None
+    order_parameter_ensemble : OrderParameterEnsemble or None
+    universe : MDAnalysis universe object
+        Universe shared by all analyses, set by run
+
+    Methods
+    -------
+    add_cluster_analysis(**kwargs)
+        Cluster every frame, see ClusterEnsemble.cluster_analysis.
+    add_nematic_op_analysis(**kwargs)
+        See OrderParameterEnsemble.nematic_op_analysis.
+    add_translational_op_analysis(director, **kwargs)
+        See OrderParameterEnsemble.translational_op_analysis.
+    add_structure_factor_analysis(**kwargs)
+        See OrderParameterEnsemble.structure_factor_analysis.
+    run(times=None, start=None, stop=None, step=None, frames=None)
+        Read the frames once and run all analyses on them.
+    """
+
+    def __init__(self, cluster_ensemble=None, order_parameter_ensemble=None,
+                 pbc_style=None):
+        """
+        Parameters
+        ----------
+        cluster_ensemble : ClusterEnsemble, optional
+        order_parameter_ensemble : OrderParameterEnsemble, optional
+            Must use the same coord and traj files as cluster_ensemble
+        pbc_style : string, optional
+            Gromacs pbc definitions: whole, mol, res, atom, nojump.
+            Applied to every frame as it is read.
+
+        Raises
+        ------
+        ValueError
+            If no ensemble is given or the ensembles use different
+            files
+        """
+        self.cluster_ensemble = cluster_ensemble
+        self.order_parameter_ensemble = order_parameter_ensemble
+
+        self._ensembles = [ensemble for ensemble in
+                           (cluster_ensemble, order_parameter_ensemble)
+                           if ensemble is not None]
+        if len(self._ensembles) == 0:
+            raise ValueError("AnalysisPipeline needs at least one ensemble")
+        for ensemble in self._ensembles[1:]:
+            if ((ensemble._coord, ensemble._traj)
+                    != (self._ensembles[0]._coord, self._ensembles[0]._traj)):
+                raise ValueError(
+                    "Ensembles do not use the same coord and traj files"
+                )
+
+        for ensemble in self._ensembles:
+            ensemble._set_pbc_style(pbc_style)
+
+        # (prepare, single_frame, conclude) of every registered analysis
+        self._analyses = []
+
+    def add_cluster_analysis(self, cut_off=7.5, style="atom", measure="b2b",
+                             algorithm="dynamic", work_in="Residue", pbc=True,
+                             skin=2.0, cluster_file=None):
+        """Register a cluster analysis, see ClusterEnsemble.cluster_analysis
+
+        Raises
+        ------
+        ValueError
+            If the pipeline has no cluster_ensemble
+        """
+        ensemble = self._get_ensemble(self.cluster_ensemble, "cluster_ensemble")
+        self._analyses.append((
+            functools.partial(
+                ensemble._prepare_cluster_analysis, cut_off=cut_off,
+                cluster_file=cluster_file, style=style, measure=measure,
+                algorithm=algorithm, work_in=work_in, pbc=pbc, skin=skin
+            ),
+            ensemble._cluster_analysis_single_frame,
+            ensemble._conclude_cluster_analysis,
+        ))
+
+    def add_nematic_op_analysis(self, style="molecule",
+                                principal_axis="inertial", custom_traj=None):
+        """Register a nematic order parameter analysis, see
+        OrderParameterEnsemble.nematic_op_analysis
+
+        Raises
+        ------
+        ValueError
+            If the pipeline has no order_parameter_ensemble
+        """
+        ensemble = self._get_ensemble(self.order_parameter_ensemble,
+                                      "order_parameter_ensemble")
+        self._analyses.append((
+            functools.partial(
+                ensemble._prepare_nematic_op, style=style,
+                principal_axis=principal_axis, custom_traj=custom_traj
+            ),
+            ensemble._nematic_op_single_frame,
+            ensemble._conclude_nematic_op,
+        ))
+
+    def add_translational_op_analysis(self, director, style="molecule",
+                                      pos_style="com",
+                                      search_param=[0.1, 50, 500],
+                                      custom_traj=None, plot=False,
+                                      unwrap=False):
+        """Register a translational order parameter analysis, see
+        OrderParameterEnsemble.translational_op_analysis
+
+        Raises
+        ------
+        ValueError
+            If the pipeline has no order_parameter_ensemble
+        """
+        ensemble = self._get_ensemble(self.order_parameter_ensemble,
+                                      "order_parameter_ensemble")
+        self._analyses.append((
+            functools.partial(
+                ensemble._prepare_translational_op, director=director,
+                style=style, pos_style=pos_style, search_param=search_param,
+                custom_traj=custom_traj, plot=plot, unwrap=unwrap
+            ),
+            ensemble._translational_op_single_frame,
+            ensemble._conclude_translational_op,
+        ))
+
+    def add_structure_factor_analysis(self, directors=None, style="molecule",
+                                      pos_style="com", q_style="strict",
+                                      q_min=0, q_max=1, q_step=0.01,
+                                      active_dim=[1, 1, 1], custom_traj=None,
+                                      chunk_size=None, plot_style="scatter",
+                                      n_bins=1000, unwrap=False,
+                                      method="direct", raw_output=None,
+                                      n_threads=1, overwrite_raw_output=False):
+        """Register a structure factor analysis, see
+        OrderParameterEnsemble.structure_factor_analysis
+
+        Raises
+        ------
+        ValueError
+            If the pipeline has no order_parameter_ensemble
+        """
+        ensemble = self._get_ensemble(self.order_parameter_ensemble,
+                                      "order_parameter_ensemble")
+        self._analyses.append((
+            functools.partial(
+                ensemble._prepare_structure_factor, directors=directors,
+                style=style, pos_style=pos_style, q_style=q_style,
+                q_min=q_min, q_max=q_max, q_step=q_step,
+                active_dim=active_dim, custom_traj=custom_traj,
+                chunk_size=chunk_size, unwrap=unwrap, method=method,
+                n_bins=n_bins, raw_output=raw_output, plot_style=plot_style,
+                n_threads=n_threads, overwrite_raw_output=overwrite_raw_output
+            ),
+            ensemble._structure_factor_single_frame,
+            functools.partial(ensemble._conclude_structure_factor,
+                              plot_style=plot_style),
+        ))
+
+    def run(self, times=None, start=None, stop=None, step=None, frames=None):
+        """Read the selected frames once and run all registered analyses
+        on every frame
+
+        Parameters
+        ----------
+        times, start, stop, step, frames
+            Selection of the frames, see ClusterEnsemble.cluster_analysis
+        """
+        ensemble = self._ensembles[0]
+        ensemble.universe = ensemble._get_universe(ensemble._coord,
+                                                   traj=ensemble._traj)
+        for other in self._ensembles[1:]:
+            other._share_universe(ensemble)
+        self.universe = ensemble.universe
+
+        frame_indices = ensemble._get_frame_indices(
+            times=times, start=start, stop=stop, step=step, frames=frames
+        )
+
+        for prepare, _, _ in self._analyses:
+            prepare(frame_indices)
+
+        # Loop over the selected frames, every frame is read only once
+        for frame_number, time in enumerate(
+                self.universe.trajectory[frame_indices]):
+            for _, single_frame, _ in self._analyses:
+                single_frame(time, frame_number)
+
+        # Rewind Trajectory to beginning for other analysis
+        self.universe.trajectory.rewind()
+
+        for _, _, conclude in self._analyses:
+            conclude()
+
+    def _get_ensemble(self, ensemble, name):
+        """Check that an ensemble needed by an analysis was given
+
+        Parameters
+        ----------
+        ensemble : BaseUniverse or None
+        name : string
+
+        Returns
+        -------
+        ensemble : BaseUniverse
+
+        Raises
+        ------
+        ValueError
+            If ensemble is None
+        """
+        if ensemble is None:
+            raise ValueError("AnalysisPipeline has no {:s}".format(name))
+
+        return ensemble
@@ -1,6 +1,7 @@
 import MDAnalysis
+import numpy as np
 import warnings
-import os
+from clustercode.PBCTransformation import PBCTransformation
 """
 ToDo:
     Make sure PBC do what we want 
@@ -40,16 +41,29 @@ class BaseUniverse():
             Needs to fit the coord file
         selection : list of string
             Strings used for the definition of species to be studied. Can be atom names or molecule names.
-        pbc_style : string
-            Use gromacs pbc definitions: mol, atom, nojump
         """
 
         self._coord = coord # Protected Attribute
         self._traj  = traj # Protected Attribute
         self.selection = selection 
+        self.pbc_style = None
+
+        # Universe and species selections reused between analyses
+        self._universe_key = None
+        self._cached_universe = None
+        self._species_cache = {}
+
+        # Flat atom indices of the last list of AtomGroups used
+        self._group_list = None
 
     def _get_universe(self, coord, traj=None):
         """Getting the universe when having or not having a trajectory
+
+        If a pbc_style is set, the periodic boundary treatment is
+        applied to every frame as it is read. The universe is cached
+        and returned again as long as coord, traj and the pbc_style
+        are the same, so the topology and the trajectory offsets are
+        only read once.
             
         Parameters
         ----------
@@ -64,15 +78,113 @@ class BaseUniverse():
         -------
         universe : MDAnalysis universe object
         """
+        key = (coord, traj, self.pbc_style)
+        if key == self._universe_key:
+            return self._cached_universe
+
         if traj is not None:
             universe = MDAnalysis.Universe(coord, traj)
         else:
             universe = MDAnalysis.Universe(coord)
+
+        if self.pbc_style is not None:
+            universe.trajectory.add_transformations(
+                PBCTransformation(universe.atoms, self.pbc_style)
+            )
+
+        # Selections of the previous universe are invalid now
+        self._universe_key = key
+        self._cached_universe = universe
+        self._species_cache = {}
         
         return universe
     
-    def _select_species(self, atoms, style="atom"):
+    def _share_universe(self, other):
+        """Use the universe loaded by another ensemble of the same files,
+        so both analyse the same frames as they are read
+
+        Parameters
+        ----------
+        other : BaseUniverse
+            Ensemble whose universe has been loaded
+
+        Raises
+        ------
+        ValueError
+            If the other ensemble uses different coord or traj files
+        """
+        if (self._coord, self._traj) != (other._coord, other._traj):
+            raise ValueError("Ensembles do not use the same coord and traj files")
+
+        self.pbc_style = other.pbc_style
+        self._universe_key = other._universe_key
+        self._cached_universe = other._cached_universe
+        self._species_cache = {}
+        self.universe = other.universe
+
+    def _get_frame_indices(self, times=None, start=None, stop=None, step=None,
+                           frames=None):
+        """Get the indices of the frames to analyse without reading them
+
+        The frames are either given directly or as a slice of the
+        trajectory and can be restricted further to a time window. The
+        times of the frames are calculated from the time of the current
+        frame and the time step dt of the trajectory, so only the frames
+        returned have to be read afterwards.
+
+        Parameters
+        ----------
+        times : list of floats, optional
+            If an interval is given like this (t_start, t_end) only
+            frames from start to end are used.
+        start : integer, optional
+            First frame, by default the first frame of the trajectory
+        stop : integer, optional
+            Frame to stop at (exclusive), by default the end of the
+            trajectory
+        step : integer, optional
+            Step between frames, by default 1
+        frames : list of integer, optional
+            Indices of the frames, can not be combined with start, stop
+            and step
+
+        Returns
+        -------
+        frame_indices : numpy array of int
+            Indices of the frames to analyse, in order
+
+        Raises
+        ------
+        ValueError
+            If frames is combined with start, stop or step
+        """
+        trajectory = self.universe.trajectory
+        all_frames = np.arange(len(trajectory))
+
+        if frames is not None:
+            if start is not None or stop is not None or step is not None:
+                raise ValueError("frames can not be combined with start, "
+                                 "stop or step")
+            frame_indices = all_frames[np.asarray(frames, dtype=int)]
+        else:
+            frame_indices = all_frames[start:stop:step]
+
+        if times is not None:
+            frame_times = (trajectory.time
+                           + (frame_indices - trajectory.frame) * trajectory.dt)
+            # Allow for rounding of the times stored in the trajectory
+            tolerance = 1e-4 * abs(trajectory.dt)
+            in_window = ((frame_times >= min(times) - tolerance)
+                         & (frame_times <= max(times) + tolerance))
+            frame_indices = frame_indices[in_window]
+
+        return frame_indices
+
+    def _select_species(self, atoms, style="atom", cache=True):
         """Get an AtomGroup of the selected species 
+
+        Selections are cached for the current universe, keyed on the
+        atoms, the style and the selection.
         
         Parameter
         ---------
@@ -84,6 +196,9 @@ class BaseUniverse():
             "atom" or "molecule" depending if the aggregating species
             is defined as the whole molecule or just parts of it, 
             e.g. the hydrophobic chain of a surfactant.
+        cache : bool, optional
+            Whether to cache the selection, by default True. Selections
+            of atoms which change all the time should not be cached.
 
         Returns
         -------
@@ -98,6 +213,12 @@ class BaseUniverse():
                                                         self.selection 
                                                         ]
         
+        atoms = atoms.atoms
+        key = (id(atoms.universe), atoms.ix.tobytes(), style,
+               tuple(self.selection))
+        if key in self._species_cache:
+            return self._species_cache[key]
+
         # If beads are choosen we look for names instead of resnames 
         if style == "atom":
             aggregate_species  = atoms.select_atoms(
@@ -107,38 +228,117 @@ class BaseUniverse():
             aggregate_species  = atoms.select_atoms(
                         "resname {:s}".format(" ".join(self.selection))
                         )
+
+        if cache:
+            self._species_cache[key] = aggregate_species
         
         return aggregate_species
 
-    def _set_pbc_style(self, pbc_style):
-        """Set the pbc style. If pbc_style is None or if the pbc_style is already set to the desired value the function does nothing, otherwise it converts the trajectory into the desired pbc style 
-        
+    def _compile_species(self, style="atom"):
+        """Compile the selected species of every residue into flat index
+        arrays (CSR layout)
+
+        The selection is only parsed once per universe. Per residue
+        reductions (e.g. centers of mass) can then be done as segment
+        operations on universe.atoms.positions[atom_indices].
+
         Parameter
         ---------
-        pbc_style : string
-            Gromacs pbc definition: mol, atom, nojump
-            
+        style : string, optional
+            "atom" or "molecule", see _select_species
+
+        Returns
+        -------
+        atom_indices : numpy array(n_atoms) of int
+            Indices of the selected atoms, ordered by residue
+        offsets : numpy array(n_residues+1) of int
+            Start of each residue in atom_indices and the total number
+            of atoms
         """
-        if pbc_style is not None:
-            if hasattr(self, "pbc_style"):
-                if self.pbc_style != pbc_style:
-                    self._change_traj_pbc(pbc_style)
-            else:
-                self._change_traj_pbc(pbc_style)
-
-    def _change_traj_pbc(self, pbc_style):
-        """Changes the pbc style of the trajectory. It uses the gromacs command (gmx trjconv).  
+        key = ("compiled", style, tuple(self.selection))
+        if key not in self._species_cache:
+            species = self._select_species(self.universe, style=style)
+
+            # Stable sort keeps the atom order within every residue
+            order = np.argsort(species.resindices, kind="stable")
+            _, residue_sizes = np.unique(species.resindices, return_counts=True)
+
+            self._species_cache[key] = (
+                species.ix[order],
+                np.concatenate(([0], np.cumsum(residue_sizes))),
+            )
+
+        return self._species_cache[key]
+
+    def _get_group_indices(self, atom_group_list):
+        """Get flat index arrays (CSR layout) of the atoms in a list of
+        AtomGroups. They are kept for the last list used, so a list used
+        every frame is only indexed once.
+
+        Parameters
+        ----------
+        atom_group_list : list of AtomGroups
+
+        Returns
+        -------
+        atom_indices : numpy array(n_atoms) of int
+            Indices of the atoms of all AtomGroups, one group after the
+            other
+        offsets : numpy array(n_groups+1) of int
+            Start of each AtomGroup in atom_indices and the total number
+            of atoms
+        """
+        if atom_group_list is not self._group_list:
+            group_sizes = [len(atom_group) for atom_group in atom_group_list]
+            atom_indices = np.concatenate(
+                [atom_group.ix for atom_group in atom_group_list] + [np.zeros(0, dtype=int)]
+            )
+
+            self._group_list = atom_group_list
+            self._group_indices = (atom_indices,
+                                   np.concatenate(([0], np.cumsum(group_sizes))).astype(int))
+
+        return self._group_indices
+
+    def _segment_sum(self, values, offsets):
+        """Sum values over the segments of a CSR layout
+
+        Parameters
+        ----------
+        values : numpy array(n_atoms, ...)
+        offsets : numpy array(n_groups+1) of int
+
+        Returns
+        -------
+        sums : numpy array(n_groups, ...)
+            Sum of the values of each segment, 0 for empty segments
+        """
+        segment_sizes = np.diff(offsets)
+        sums = np.zeros((len(segment_sizes),) + values.shape[1:])
+
+        # reduceat needs the start of every non-empty segment
+        non_empty = segment_sizes > 0
+        if non_empty.any():
+            sums[non_empty] = np.add.reduceat(values, offsets[:-1][non_empty], axis=0)
+
+        return sums
+
+    def _set_pbc_style(self, pbc_style):
+        """Set the pbc style applied to the trajectory when the universe is loaded. If pbc_style is None the pbc style set before is kept.
         
         Parameter
         ---------
         pbc_style : string
-            Gromacs pbc definition: mol, atom, nojump
-            
+            Gromacs pbc definition: whole, mol, res, atom, nojump
+
+        Raises
+        ------
+        NotImplementedError
+            If an unspecified pbc_style is choosen
         """
-        new_traj = self._traj[:-4] + "_pbc_{:s}".format(pbc_style) + self._traj[-4:]
-        # Gromacs command to convert current trajectory file to a new trajectory file with name new_traj.
-        gromacs_command = "gmx trjconv -f {:s} -o {:s} -s {:s} -pbc {:s} <<EOF\n 0\n EOF".format(self._traj, new_traj, self._coord, pbc_style)
-        os.system(gromacs_command)
-        
-        self._traj = new_traj
-        self.pbc_style = pbc_style
\ No newline at end of file
+        if pbc_style is not None:
+            if pbc_style not in ("whole", "mol", "res", "atom", "nojump"):
+                raise NotImplementedError(
+                    "{:s} is unspecified pbc_style".format(pbc_style)
+                )
+            self.pbc_style = pbc_style
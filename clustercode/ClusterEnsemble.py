@@ -1,8 +1,17 @@
 import MDAnalysis
 import MDAnalysis.lib.NeighborSearch as NeighborSearch
+import MDAnalysis.lib.distances as distances
+import numpy as np
+import multiprocessing
+import collections
+import scipy.sparse
+import scipy.sparse.csgraph
 import warnings
 import matplotlib.pyplot as plt
 from clustercode.BaseUniverse import BaseUniverse
+from clustercode.ClusterTrajectory import ClusterTrajectory
+from clustercode.DisjointSet import DisjointSet
+from clustercode.NeighbourList import NeighbourList
 
 # from MDAnalysis.core.groups import ResidueGroup
 """
@@ -23,9 +32,10 @@ class ClusterEnsemble(BaseUniverse):
     cluster_objects : list of str
         Strings used for the definition of species which form
         clusters. Can be atom names or molecule names.
-    cluster_list : list of list of MDAnalysis ResidueGroups
-        a list of ResidueGroups forms one cluster at a given time,
-        for multiple times a list of these lists is produced.
+    cluster_list : ClusterTrajectory
+        Cluster labels of every molecule or atom for all analysed
+        times. Indexing it with a frame gives the list of
+        ResidueGroups or AtomGroups, one per cluster, at that time.
 
     Methods
     -------
@@ -33,6 +43,14 @@ class ClusterEnsemble(BaseUniverse):
                      algorithm="static")
         Calculates which molecules are clustering together for all
         timesteps.
+    iter_clusters(cut_off=7.5, style="atom", measure="b2b",
+                  algorithm="dynamic")
+        Yields the clusters of one timestep after the other.
+    cluster_size_distribution(frames=(0, None, 1), weighting="number")
+        Cluster size distribution accumulated over frames.
+    cluster_tracking(min_fragment=2)
+        Follows clusters between frames and finds their lifetimes,
+        fusion, fission and exchange events.
     """
 
     def __init__(self, coord, traj, cluster_objects):
@@ -54,7 +72,9 @@ class ClusterEnsemble(BaseUniverse):
 
     def cluster_analysis(self, cut_off=7.5, times=None, style="atom", 
                     measure="b2b", algorithm="dynamic", work_in="Residue",
-                    traj_pbc_style=None, pbc=True):
+                    traj_pbc_style=None, pbc=True, n_workers=1,
+                    backend="multiprocessing", cluster_file=None, skin=2.0,
+                    start=None, stop=None, step=None, frames=None):
         """High level function clustering molecules together
 
         Example
@@ -80,11 +100,28 @@ class ClusterEnsemble(BaseUniverse):
             cluster_objects attribute is interpreted as molecule
             or atoms within a molecule.
         measure : string, optional
-            "b2b (bead to bead), COM or COG(center of geometry)
+            "b2b" (bead to bead), "COM" (center of mass) or "COG"
+            (center of geometry), by default "b2b". With COM or COG
+            two molecules are in the same cluster if the centers of
+            their aggregate species are within cut_off. The centers of
+            all molecules are calculated at once and searched with a
+            single pair search, so this needs work_in = "Residue" and
+            the unionfind, csgraph or incremental algorithm. Molecules
+            have to be whole, e.g. traj_pbc_style = "mol".
         algorithm : string, optional
-            "dynamic" or "static". The static one is slower. I
-            loops over all atoms and then merges cluster, whereas
-            the dynamic algorithm grows clusters dynamically.
+            "dynamic", "static", "unionfind", "csgraph" or
+            "incremental". The static
+            one is slower. It loops over all atoms and then merges
+            cluster, whereas the dynamic algorithm grows clusters
+            dynamically. The unionfind algorithm finds all pairs within
+            cut_off in one search per frame and labels the clusters
+            with a disjoint-set, which is fastest for large systems.
+            The csgraph algorithm labels the connected components of
+            the sparse adjacency matrix of the same pairs with scipy.
+            The incremental algorithm starts from the clusters of the
+            previous frame and only rechecks pairs close to cut_off,
+            which is fastest for densely sampled trajectories. All
+            algorithms give the same clusters.
         work_in : string, optional
             "Residue" or "Atom". Either work in (and output)
             ResidueGroups or AtomGroups.
@@ -94,8 +131,10 @@ class ClusterEnsemble(BaseUniverse):
             parts of the same molecule can be in different clusters
             (i.e. block copolymers).
         traj_pbc_style : string, optional
-            Gromacs pbc definitions: mol or atom, by default
-            None
+            Gromacs pbc definitions: whole, mol, res, atom or nojump,
+            by default None (the trajectory is used as it is, or with
+            the pbc style set before). It is applied to every frame
+            as it is read, no new trajectory is written.
         pbc : bool, optional
             Whether to consider periodic boundary conditions in the 
             neighbour search (for determining whether atoms belong to
@@ -103,53 +142,380 @@ class ClusterEnsemble(BaseUniverse):
             set to "Residue" periodic boundary conditions are taken into
             account implicitly for atoms in molecules passing across the 
             boundaries.
+        n_workers : int, optional
+            Number of processes the frames are clustered on, by
+            default 1. Each worker opens its own universe once and
+            is handed blocks of 4 frames. At most 2*n_workers blocks
+            are in flight, so the memory does not grow with the
+            length of the trajectory, and the results are merged back
+            in frame order block by block.
+        backend : string, optional
+            "multiprocessing" or "serial", by default
+            "multiprocessing". Only used if n_workers is larger
+            than 1.
+        cluster_file : string, optional
+            Path of a .npy file the cluster labels are memory-mapped
+            to, by default None (labels are kept in memory).
+        skin : float, optional
+            Skin distance of the neighbour list used by the unionfind,
+            csgraph and incremental algorithms, by default 2.0
+            Angstroem. Pairs within cut_off + skin are kept across
+            frames and only searched again once an atom moved by more
+            than skin/2. A skin of 0 searches all pairs in every frame.
+        start, stop, step : integer, optional
+            Only cluster the frames trajectory[start:stop:step], by
+            default all frames. Frames outside are never read.
+        frames : list of integer, optional
+            Indices of the frames to cluster, instead of start, stop
+            and step. times is applied on top of either.
 
         Raises
         ------
         NotImplementedError
-            If an unspecified algorithm or work_in is choosen
+            If an unspecified algorithm, measure, work_in or backend is
+            choosen
         ValueError
-            If pbc is not boolean
+            If pbc is not boolean or frames is combined with start,
+            stop or step
         
         ToDo
         ----
-        -Make static and dynamic algorithms store the same arguments
         -Add plotting capabilities
-        -Add capabilities to only look at certain time windows
         -Get rid of traj and coord attributes
         """
 
+        cluster_algorithm = self._start_cluster_analysis(
+            traj_pbc_style=traj_pbc_style, style=style, measure=measure,
+            algorithm=algorithm, work_in=work_in, pbc=pbc, skin=skin
+        )
+        frame_indices = self._get_frame_indices(
+            times=times, start=start, stop=stop, step=step, frames=frames
+        )
+        self._prepare_cluster_list(frame_indices, cluster_file=cluster_file)
+
+        for labels, sizes, time in self._iter_cluster_labels(
+            cluster_algorithm, frame_indices, cut_off=cut_off,
+            n_workers=n_workers, backend=backend,
+            block_kwargs=dict(style=style, measure=measure,
+                              algorithm=algorithm, work_in=work_in, pbc=pbc,
+                              skin=skin)
+        ):
+            self._store_cluster_labels(labels, sizes, time)
+
+        self.cluster_list.flush()
+
+    def _prepare_cluster_list(self, frame_indices, cluster_file=None):
+        """Initialise the cluster_list for the frames analysed
+
+        Parameters
+        ----------
+        frame_indices : numpy array of int
+            Indices of the frames analysed
+        cluster_file : string, optional
+            See cluster_analysis
+        """
+        if self.search_level == "R":
+            species = self.aggregate_species.residues
+        elif self.search_level == "A":
+            species = self.aggregate_species
+        self.cluster_list = ClusterTrajectory(
+            species, len(frame_indices), filename=cluster_file
+        )
+
+    def _store_cluster_labels(self, labels, sizes, time):
+        """Append the cluster labels of a frame to the cluster_list
+
+        Parameters
+        ----------
+        labels : numpy array(n_species) of int32
+        sizes : numpy array(n_clusters) of int
+        time : float
+        """
+        self.cluster_list.append(labels, time)
+        print("****TIME: {:8.2f}".format(time))
+        print("---->Number of clusters {:d}".format(len(sizes)))
+
+    def _prepare_cluster_analysis(self, frame_indices, cut_off=7.5,
+                                  cluster_file=None, **kwargs):
+        """Initialise a cluster analysis driven frame by frame from
+        outside, e.g. by an AnalysisPipeline
+
+        Parameters
+        ----------
+        frame_indices : numpy array of int
+            Indices of the frames analysed
+        cut_off, cluster_file
+            See cluster_analysis
+        **kwargs
+            style, measure, algorithm, work_in, pbc and skin, see
+            cluster_analysis
+        """
+        self._cluster_algorithm = self._start_cluster_analysis(**kwargs)
+        self._cluster_cut_off = cut_off
+        self._prepare_cluster_list(frame_indices, cluster_file=cluster_file)
+
+    def _cluster_analysis_single_frame(self, time, frame_number):
+        """Cluster the current frame and store its labels
+
+        Parameters
+        ----------
+        time : MDAnalysis Timestep
+            Current frame
+        frame_number : integer
+            Position of the frame in the analysed frames
+        """
+        labels = np.asarray(self._clusters_to_labels(
+            self._cluster_algorithm(cut_off=self._cluster_cut_off)
+        ), dtype=np.int32)
+        self._store_cluster_labels(labels, np.bincount(labels), time.time)
+
+    def _conclude_cluster_analysis(self):
+        """Write the cluster_list to disk if it is memory-mapped
+        """
+        self.cluster_list.flush()
+
+    def iter_clusters(self, cut_off=7.5, times=None, style="atom", 
+                      measure="b2b", algorithm="dynamic", work_in="Residue",
+                      traj_pbc_style=None, pbc=True, n_workers=1,
+                      backend="multiprocessing", skin=2.0, start=None,
+                      stop=None, step=None, frames=None):
+        """Cluster the trajectory one frame after the other
+
+        Same as cluster_analysis, but the clusters of every frame are
+        yielded as soon as they are found and not stored, so the
+        memory needed does not grow with the length of the trajectory.
+
+        Example
+        -------
+        Size histogram of a long trajectory:
+
+        >>> histogram = np.zeros(n_molecules + 1)
+        >>> for labels, sizes, time in ensemble.iter_clusters(cut_off=5.0,
+        ...                                                   algorithm="unionfind"):
+        ...     histogram += np.bincount(sizes, minlength=n_molecules + 1)
+
+        Parameters
+        ----------
+        cut_off, times, style, measure, algorithm, work_in, traj_pbc_style,
+        pbc, skin, start, stop, step, frames
+            See cluster_analysis
+        n_workers : int, optional
+            Number of processes the frames are clustered on, by
+            default 1. Frames are still yielded in order as soon as
+            their block of 4 frames is done. At most 2*n_workers blocks
+            are in flight, so only that many frames are held at once.
+        backend : string, optional
+            "multiprocessing" or "serial", see cluster_analysis
+
+        Yields
+        ------
+        labels : numpy array(n_species) of int32
+            Cluster label of each species, ordered by the first species
+            of each cluster
+        sizes : numpy array(n_clusters) of int
+            Number of molecules or atoms in each cluster
+        time : float
+            Time of the frame
+
+        Raises
+        ------
+        NotImplementedError
+            If an unspecified algorithm, measure, work_in or backend is
+            choosen
+        ValueError
+            If pbc is not boolean or frames is combined with start,
+            stop or step
+        """
+        cluster_algorithm = self._start_cluster_analysis(
+            traj_pbc_style=traj_pbc_style, style=style, measure=measure,
+            algorithm=algorithm, work_in=work_in, pbc=pbc, skin=skin
+        )
+        frame_indices = self._get_frame_indices(
+            times=times, start=start, stop=stop, step=step, frames=frames
+        )
+
+        yield from self._iter_cluster_labels(
+            cluster_algorithm, frame_indices, cut_off=cut_off,
+            n_workers=n_workers, backend=backend,
+            block_kwargs=dict(style=style, measure=measure,
+                              algorithm=algorithm, work_in=work_in, pbc=pbc,
+                              skin=skin)
+        )
+
+    def _start_cluster_analysis(self, traj_pbc_style=None, work_in="Residue",
+                                pbc=True, **kwargs):
+        """Set the pbc style of the trajectory and initialise the
+        clustering
+
+        Parameters
+        ----------
+        traj_pbc_style, work_in, pbc
+            See cluster_analysis
+        **kwargs
+            Further keyword arguments of _init_cluster_analysis
+
+        Returns
+        -------
+        cluster_algorithm : method
+            Method clustering a single frame
+        """
         self._set_pbc_style(traj_pbc_style)
 
+        if (pbc == False and work_in == "Residue"
+                and self.pbc_style not in ("whole", "mol", "res")):
+            warnings.warn('work_in = "Residue" implicitly enforces pbc '\
+                          'for atoms in the same molecule if pbc_style '\
+                          '= "atom"', UserWarning)
+            print('Warning')
+
+        return self._init_cluster_analysis(work_in=work_in, pbc=pbc, **kwargs)
+
+    def _iter_cluster_labels(self, cluster_algorithm, frame_indices, cut_off=7.5,
+                             n_workers=1, backend="multiprocessing",
+                             block_kwargs=None):
+        """Cluster the frames in frame_indices and yield their labels
+
+        Parameters
+        ----------
+        cluster_algorithm : method
+            Method clustering a single frame, see _init_cluster_analysis
+        frame_indices : numpy array of int
+            Indices of the frames to cluster, in order
+        cut_off, n_workers, backend
+            See cluster_analysis
+        block_kwargs : dict, optional
+            Keyword arguments of _init_cluster_analysis passed to the
+            worker processes
+
+        Yields
+        ------
+        labels : numpy array(n_species) of int32
+        sizes : numpy array(n_clusters) of int
+        time : float
+        """
+        if backend == "serial" or n_workers == 1:
+            frame_results = self._iter_frames(
+                cluster_algorithm, frame_indices, cut_off
+            )
+        elif backend == "multiprocessing":
+            frame_results = self._iter_frames_parallel(
+                frame_indices, cut_off, n_workers, block_kwargs
+            )
+        else:
+            raise NotImplementedError(
+                "{:s} is unspecified backend".format(backend)
+            )
+
+        try:
+            for time, labels in frame_results:
+                labels = np.asarray(labels, dtype=np.int32)
+                yield labels, np.bincount(labels), time
+        finally:
+            # Rewind Trajectory to beginning for other analysis
+            self.universe.trajectory.rewind()
+
+    def _iter_frames(self, cluster_algorithm, frame_indices, cut_off):
+        """Cluster the frames in frame_indices in this process
+
+        Yields
+        ------
+        time : float
+        labels : numpy array(n_species) of int
+        """
+        # Only the selected frames are read from the trajectory
+        for time in self.universe.trajectory[frame_indices]:
+            yield time.time, self._clusters_to_labels(
+                cluster_algorithm(cut_off=cut_off)
+            )
+
+    def _iter_frames_parallel(self, frame_indices, cut_off, n_workers,
+                              block_kwargs, block_size=4):
+        """Cluster the frames in frame_indices on n_workers processes
+
+        The frames are handed out in small blocks of block_size frames
+        and at most two blocks per worker are in flight, so the memory
+        is bounded by the number of workers times block_size, however
+        long the trajectory is.
+
+        Yields
+        ------
+        time : float
+        labels : numpy array(n_species) of int32
+        """
+        frame_blocks = (frame_indices[start:start + block_size]
+                        for start in range(0, len(frame_indices), block_size))
+
+        # Each worker opens its own universe once and keeps it for all
+        # of its blocks
+        worker_arguments = (self._coord, self._traj, self.selection,
+                            self.pbc_style, block_kwargs)
+        with multiprocessing.Pool(n_workers, initializer=_init_cluster_worker,
+                                  initargs=worker_arguments) as pool:
+            pending = collections.deque()
+            for frame_block in frame_blocks:
+                pending.append(pool.apply_async(_cluster_frame_block,
+                                                (frame_block, cut_off)))
+                # Blocks are returned in frame order as soon as they are done
+                if len(pending) >= 2 * n_workers:
+                    yield from pending.popleft().get()
+            while pending:
+                yield from pending.popleft().get()
+
+    def _init_cluster_analysis(self, style="atom", measure="b2b",
+                               algorithm="dynamic", work_in="Residue",
+                               pbc=True, skin=2.0):
+        """Load the universe and set up the neighbour search and the
+        species for clustering
+
+        Parameters
+        ----------
+        style : string, optional
+            "atom" or "molecule"
+        measure : string, optional
+            "b2b", "COM" or "COG"
+        algorithm : string, optional
+            "dynamic", "static", "unionfind", "csgraph" or "incremental"
+        work_in : string, optional
+            "Residue" or "Atom"
+        pbc : bool, optional
+            Whether to consider periodic boundary conditions in the
+            neighbour search
+        skin : float, optional
+            Skin distance of the neighbour list
+
+        Returns
+        -------
+        cluster_algorithm : method
+            Method clustering a single frame, returning either cluster
+            labels or a list of clusters
+
+        Raises
+        ------
+        NotImplementedError
+            If an unspecified algorithm, measure or work_in is choosen,
+            or if measure is "COM" or "COG" and work_in is not "Residue"
+            or the algorithm searches neighbours atom by atom
+        ValueError
+            If pbc is not boolean
+        """
         self.universe = self._get_universe(self._coord, traj=self._traj)
 
         self.style = style
 
         self.aggregate_species = self._select_species(self.universe, style=self.style)
 
-        self.cluster_list = []
+        self.pbc = pbc
 
-        # Initialise the neighboursearch object
+        self.skin = skin
 
-        if pbc == True:
-            self.neighbour_search = NeighborSearch.AtomNeighborSearch(
-            self.aggregate_species, 
-            box=self.universe.dimensions,
-            bucket_size=10
-            )
-        elif pbc == False:
-            if work_in == "Residue" and traj_pbc_style != "mol":
-                warnings.warn('work_in = "Residue" implicitly enforces pbc '\
-                              'for atoms in the same molecule if pbc_style '\
-                              '= "atom"', UserWarning)
-                print('Warning')
-            self.neighbour_search = NeighborSearch.AtomNeighborSearch(
-                self.aggregate_species, 
-                box=None,
-                bucket_size=10
-                )
-        else:
+        # Neighbour list shared across frames, built on first use
+        self.neighbour_list = None
+
+        # The neighboursearch object is initialised with the box of the
+        # first frame it is used in
+        if pbc not in (True, False):
             raise ValueError("pbc has to be boolean")
+        self.neighbour_search = None
 
         if work_in == "Residue":
             self.search_level = "R"
@@ -160,103 +526,369 @@ class ClusterEnsemble(BaseUniverse):
                 "{:s} is unspecified work_in variable".format(work_in)
             )
 
+        self._set_species_index()
+
+        if measure not in ("b2b", "COM", "COG"):
+            raise NotImplementedError(
+                "{:s} is unspecified measure".format(measure)
+            )
+        if measure != "b2b":
+            if self.search_level != "R":
+                raise NotImplementedError(
+                    "{:s} measure needs work_in Residue".format(measure)
+                )
+            if algorithm in ("static", "dynamic"):
+                raise NotImplementedError(
+                    "{:s} measure is unspecified for the {:s} algorithm".format(
+                        measure, algorithm)
+                )
+        self.measure = measure
+
         if algorithm == "static":
-            cluster_algorithm = self._get_cluster_list_static
+            cluster_algorithm = self._get_cluster_labels_static
         elif algorithm == "dynamic":
             cluster_algorithm = self._get_cluster_list_dynamic
+        elif algorithm == "unionfind":
+            cluster_algorithm = self._get_cluster_labels_unionfind
+        elif algorithm == "csgraph":
+            cluster_algorithm = self._get_cluster_labels_csgraph
+        elif algorithm == "incremental":
+            cluster_algorithm = self._get_cluster_labels_incremental
         else:
             raise NotImplementedError("{:s} is unspecified algorithm".format(algorithm))
-        # Loop over all trajectory times
-        for time in self.universe.trajectory:
-            if times is not None:
-                if time.time > max(times) or time.time < min(times):
-                    continue
-            self.cluster_list.append(cluster_algorithm())
-            print("****TIME: {:8.2f}".format(time.time))
-            print("---->Number of clusters {:d}".format(len(self.cluster_list[-1])))
-
-        # Rewind Trajectory to beginning for other analysis
-        self.universe.trajectory.rewind()
-
-    def _get_cluster_list_static(self, cut_off=7.5):
-        """Get Cluster from single frame with the static method
-        
-        This code simply loops over all atoms in the aggregate
-        species and finds a cluster for each atom (all neighbours).
-        This cluster is merged into the already found clusters.
+
+        return cluster_algorithm
+
+    def _cluster_frame_block(self, cluster_algorithm, frame_block,
+                             cut_off=7.5):
+        """Cluster a block of frames, used by the workers of the
+        parallel cluster_analysis
 
         Parameters
         ----------
+        cluster_algorithm : method
+            Method clustering a single frame, see _init_cluster_analysis
+        frame_block : numpy array of int
+            Indices of the frames of the block, in order
         cut_off : float, optional
-            Radius around which to search for neighbours 
+            See cluster_analysis
 
         Returns
         -------
-        cluster_list : list of ResGroups or AtomGroups
+        block_result : list of (float, numpy array(n_species) of int32)
+            Time and cluster labels of each clustered frame
+        """
+        block_result = []
+        for time in self.universe.trajectory[frame_block]:
+            block_result.append((
+                time.time,
+                self._clusters_to_labels(cluster_algorithm(cut_off=cut_off)),
+            ))
+
+        return block_result
+
+    def _update_neighbour_search(self):
+        """Initialise the neighboursearch object again if the box of the
+        current frame differs from the one it was initialised with
+        """
+        box = self.universe.dimensions if self.pbc else None
+
+        if self.neighbour_search is not None:
+            if box is None or np.array_equal(box, self._neighbour_search_box):
+                return
+
+        self.neighbour_search = NeighborSearch.AtomNeighborSearch(
+            self.aggregate_species, 
+            box=box,
+            )
+        self._neighbour_search_box = None if box is None else box.copy()
+
+    def _set_species_index(self):
+        """Map every atom of the aggregate species to its species index
+
+        The species are the residues of the aggregate species if
+        search_level is "R" and its atoms if search_level is "A". The
+        species index is the position in self.aggregate_species.residues
+        or self.aggregate_species respectively. species_lookup maps the
+        resindex or atom index of the universe to the species index
+        (-1 if it is not part of the aggregate species).
         """
-        cluster_list = []
         if self.search_level == "R":
-            aggregate_species_atoms = self.aggregate_species.groupby("resids").values()
+            species = self.aggregate_species.residues
+            self.species_lookup = np.full(self.universe.residues.n_residues, -1)
+            self.species_lookup[species.ix] = np.arange(species.n_residues)
+            self.species_index = self.species_lookup[self.aggregate_species.resindices]
         elif self.search_level == "A":
-            aggregate_species_atoms = self.aggregate_species
+            species = self.aggregate_species
+            self.species_lookup = np.full(self.universe.atoms.n_atoms, -1)
+            self.species_lookup[species.ix] = np.arange(species.n_atoms)
+            self.species_index = np.arange(species.n_atoms)
 
-        for atoms in aggregate_species_atoms:
-            cluster_temp = set(
-                self.neighbour_search.search(
-                    atoms=atoms, radius=cut_off, level=self.search_level
-                )
+        self.n_species = len(species)
+
+    def _get_search_positions(self):
+        """Get the positions the neighbours are searched between
+
+        Returns
+        -------
+        positions : numpy array(n,3)
+            Positions of the atoms of the aggregate species if measure
+            is "b2b", otherwise the center of mass or geometry of the
+            aggregate species of each residue
+        search_index : numpy array(n) of int
+            Species index of each position
+        """
+        if self.measure == "COM":
+            positions = self.aggregate_species.center_of_mass(compound="residues")
+        elif self.measure == "COG":
+            positions = self.aggregate_species.center_of_geometry(
+                compound="residues")
+        else:
+            return self.aggregate_species.positions, self.species_index
+
+        return positions.astype(np.float32), np.arange(self.n_species)
+
+    def _get_neighbour_list(self, cut_off=7.5):
+        """Get the neighbour list of the search positions
+
+        Parameters
+        ----------
+        cut_off : float, optional
+            Radius around which to search for neighbours
+
+        Returns
+        -------
+        neighbour_list : NeighbourList
+            Neighbour list of the search positions, pairs of atoms in
+            the same species are left out
+        """
+        if self.neighbour_list is None or self.neighbour_list.cut_off != cut_off:
+            groups = self.species_index if self.measure == "b2b" else None
+            self.neighbour_list = NeighbourList(
+                cut_off, skin=self.skin, groups=groups
             )
 
-            cluster_list = self._merge_cluster(cluster_list, cluster_temp)
+        return self.neighbour_list
 
-        return cluster_list
+    def _get_neighbour_pairs(self, cut_off=7.5):
+        """Get all pairs of different species closer than cut_off
+
+        Parameters
+        ----------
+        cut_off : float, optional
+            Radius around which to search for neighbours
+
+        Returns
+        -------
+        species_i : numpy array(m) of int
+        species_j : numpy array(m) of int
+            Species indices of all pairs of atoms within cut_off
+        """
+        box = self.universe.dimensions if self.pbc else None
+        positions, search_index = self._get_search_positions()
+        pairs = self._get_neighbour_list(cut_off).get_pairs(positions, box=box)
+        species_i = search_index[pairs[:, 0]]
+        species_j = search_index[pairs[:, 1]]
+
+        return species_i, species_j
+
+    def _get_cluster_labels_unionfind(self, cut_off=7.5):
+        """Get cluster labels from single frame with union-find
+
+        All neighbouring pairs are found with a single capped distance
+        search and merged in bulk into a disjoint-set of the species.
+
+        Parameters
+        ----------
+        cut_off : float, optional
+            Radius around which to search for neighbours
+
+        Returns
+        -------
+        labels : numpy array(n_species) of int
+            Cluster label of each species, ordered by the first species
+            of each cluster
+        """
+        disjoint_set = DisjointSet(self.n_species)
+        disjoint_set.union_pairs(*self._get_neighbour_pairs(cut_off))
+
+        return disjoint_set.labels()
+
+    def _get_cluster_labels_csgraph(self, cut_off=7.5):
+        """Get cluster labels from single frame with scipy.sparse.csgraph
+
+        The neighbouring pairs (reduced to residue pairs if
+        search_level is "R") form a sparse adjacency matrix whose
+        connected components are the clusters.
+
+        Parameters
+        ----------
+        cut_off : float, optional
+            Radius around which to search for neighbours
+
+        Returns
+        -------
+        labels : numpy array(n_species) of int
+            Cluster label of each species, ordered by the first species
+            of each cluster
+        """
+        species_i, species_j = self._get_neighbour_pairs(cut_off)
+
+        adjacency = scipy.sparse.coo_matrix(
+            (np.ones(len(species_i), dtype=np.int8), (species_i, species_j)),
+            shape=(self.n_species, self.n_species),
+        )
+        _, labels = scipy.sparse.csgraph.connected_components(
+            adjacency, directed=False
+        )
+
+        return labels
+
+    def _get_cluster_labels_incremental(self, cut_off=7.5):
+        """Get cluster labels from single frame, starting from the
+        clusters of the previous frame
+
+        The neighbour list contains all pairs within cut_off + skin of
+        its reference frame. Only pairs whose distance may have crossed
+        cut_off since the reference frame are recalculated. Clusters
+        are only rebuilt if one of their bonds broke, and merged if a
+        bond formed between them, all other clusters are kept from the
+        previous frame.
+
+        Parameters
+        ----------
+        cut_off : float, optional
+            Radius around which to search for neighbours
+
+        Returns
+        -------
+        labels : numpy array(n_species) of int
+            Cluster label of each species, ordered by the first species
+            of each cluster
+        """
+        positions, search_index = self._get_search_positions()
+        box = self.universe.dimensions if self.pbc else None
+
+        neighbour_list = self._get_neighbour_list(cut_off)
+
+        # Cluster from scratch in the reference frame of the list
+        if neighbour_list.update(positions, box=box):
+            self._bonded = neighbour_list.reference_distances <= cut_off
+            bonded_pairs = neighbour_list.candidate_pairs[self._bonded]
+
+            disjoint_set = DisjointSet(self.n_species)
+            disjoint_set.union_pairs(search_index[bonded_pairs[:, 0]],
+                                     search_index[bonded_pairs[:, 1]])
+            self._labels = disjoint_set.labels()
+
+            return self._labels
+
+        # A distance can only have changed by the sum of the
+        # displacements of both atoms and the strain of the box since
+        # the reference frame
+        atoms_i = neighbour_list.candidate_pairs[:, 0]
+        atoms_j = neighbour_list.candidate_pairs[:, 1]
+        displacement = neighbour_list.displacement
+        reference_distances = neighbour_list.reference_distances
+        bonded = reference_distances <= cut_off
+        uncertain = (np.abs(reference_distances - cut_off)
+                     <= displacement[atoms_i] + displacement[atoms_j]
+                     + neighbour_list.strain * reference_distances)
+        bonded[uncertain] = distances.calc_bonds(
+            positions[atoms_i[uncertain]], positions[atoms_j[uncertain]],
+            box=box
+        ) <= cut_off
+
+        changed = bonded != self._bonded
+        self._bonded = bonded
+        if not changed.any():
+            return self._labels
+
+        species_i = search_index[atoms_i]
+        species_j = search_index[atoms_j]
+        formed = changed & bonded
+        broken = changed & ~bonded
+
+        # Clusters with a broken bond are flooded again over their
+        # current bonds, all other clusters are kept
+        n_clusters = self._labels.max() + 1
+        dirty_clusters = np.zeros(n_clusters, dtype=bool)
+        dirty_clusters[self._labels[species_i[broken]]] = True
+        dirty = dirty_clusters[self._labels]
+
+        first_species = np.unique(self._labels, return_index=True)[1]
+        clean_species = np.flatnonzero(~dirty)
+
+        disjoint_set = DisjointSet(self.n_species)
+        disjoint_set.union_pairs(
+            clean_species, first_species[self._labels[clean_species]]
+        )
+        reflood = (bonded & dirty[species_i]) | formed
+        disjoint_set.union_pairs(species_i[reflood], species_j[reflood])
+
+        self._labels = disjoint_set.labels()
+
+        return self._labels
+
+    def _clusters_to_labels(self, clusters):
+        """Convert the clusters of a single frame to cluster labels
+
+        Parameters
+        ----------
+        clusters : list of clusters or numpy array of int
+            Either a list of ResGroups or AtomGroups or an array of
+            cluster labels
+
+        Returns
+        -------
+        labels : numpy array(n_species) of int
+            Cluster label of each species, in order of the clusters
+        """
+        if isinstance(clusters, np.ndarray):
+            return clusters
 
-    def _merge_cluster(self, cluster_list, cluster_temp):
-        """Code to merge a cluster into a cluster list
+        labels = np.empty(self.n_species, dtype=np.int32)
+        for label, cluster in enumerate(clusters):
+            labels[self.species_lookup[cluster.ix]] = label
+
+        return labels
+
+    def _get_cluster_labels_static(self, cut_off=7.5):
+        """Get cluster labels from single frame with the static method
         
-        This code merges a cluster into a clusterlist by reverse
-        looping over the cluster list. Whenever an overlap is detected
-        the new, temporary, cluster is merged into the old one and
-        the new one is deleted. At the same time the temporary cluster
-        is updated to be the old one merged with the new one to
-        further look for overlap.
+        This code simply loops over all atoms in the aggregate
+        species and finds a cluster for each atom (all neighbours).
+        This cluster is merged into a disjoint-set of all species,
+        which takes near-constant amortized time per neighbour.
 
         Parameters
         ----------
-        cluster_list : list of sets of clusterids
-            All the sets of clusters already present.
-        cluster_temp : set of clusterids
-            Last found cluster, to be merged into the cluster_list
+        cut_off : float, optional
+            Radius around which to search for neighbours 
 
         Returns
         -------
-        cluster_list : list of sets of clusterids
-            Updated cluster_list
-
-        """
-        cluster_list.append(cluster_temp)
-        merged_index = []
-
-        # Loop through cluster_list in reverse with the actual also
-        # the revesed indices
-        for i, cluster in reversed(list(enumerate(cluster_list))):
-            # If there is an intersection start merging. There is
-            # always an intersection with the first cluster (identical)
-            if bool(cluster.intersection(cluster_temp)):
-                cluster_temp = cluster_temp | cluster  # Updating cluster_temp
-                cluster_list[i] = cluster_temp
-                merged_index.append(i)
-                # If the cluster is not completely new there will be a
-                # second intersection and we delete the previous cluster
-                # Note that len(merged_index) goes back to 1 afterwards
-                # and cluster_temp is the new merged cluster
-                if len(merged_index) > 1.5:
-                    del cluster_list[merged_index[0]]
-                    del merged_index[0]
-                elif len(merged_index) > 1.5:
-                    warnings.warn("Wrong behaviour in cluster merge", UserWarning)
+        labels : numpy array(n_species) of int
+            Cluster label of each species, ordered by the first species
+            of each cluster
+        """
+        self._update_neighbour_search()
 
-        return cluster_list
+        disjoint_set = DisjointSet(self.n_species)
+
+        if self.search_level == "R":
+            aggregate_species_atoms = self.aggregate_species.groupby("resids").values()
+        elif self.search_level == "A":
+            aggregate_species_atoms = self.aggregate_species
+
+        for atoms in aggregate_species_atoms:
+            cluster_temp = self.neighbour_search.search(
+                atoms=atoms, radius=cut_off, level=self.search_level
+            )
+
+            disjoint_set.union_group(self.species_lookup[cluster_temp.ix])
+
+        return disjoint_set.labels()
 
     def _get_cluster_list_dynamic(self, cut_off=7.5):
         """Get Cluster from single frame with dynamic algorithm
@@ -278,6 +910,8 @@ class ClusterEnsemble(BaseUniverse):
         cluster_list : list of ResGroups or AtomGroups
 
         """
+        self._update_neighbour_search()
+
         cluster_list = []
 
         if self.search_level == "R":
@@ -344,7 +978,8 @@ class ClusterEnsemble(BaseUniverse):
             # Find neighbours and cast into ResidueGroup
             new_cluster_species = MDAnalysis.core.groups.ResidueGroup(
                 self.neighbour_search.search(
-                    atoms=self._select_species(search_set.atoms, style=self.style),
+                    atoms=self._select_species(search_set.atoms, style=self.style,
+                                               cache=False),
                     radius=cut_off,
                     level=self.search_level,
                 )
@@ -361,6 +996,320 @@ class ClusterEnsemble(BaseUniverse):
 
         return search_set, cluster_temp
 
+    def cluster_tracking(self, min_fragment=2):
+        """Follow clusters from frame to frame and find fusion, fission
+        and exchange events
+
+        Clusters of consecutive frames are matched through the sparse
+        overlap matrix of the molecules (or atoms) they share. A cluster
+        continues as the cluster it shares most molecules with if that
+        cluster also shares most of its molecules with it, otherwise a
+        new track starts. Overlaps of at least min_fragment molecules
+        are fragments: a cluster splitting into several fragments is a
+        fission, several fragments joining one cluster is a fusion.
+        Smaller overlaps which do not continue a cluster are exchange
+        events, e.g. a monomer leaving one micelle and joining another.
+
+        Example
+        -------
+        ClstrEns.cluster_analysis(algorithm="unionfind")
+        ClstrEns.cluster_tracking()
+        ClstrEns.fusion_events["time"]
+
+        Parameters
+        ----------
+        min_fragment : integer, optional
+            Minimum number of shared molecules for an overlap to count
+            as a fragment in fusion and fission events, by default 2
+
+        Attributes
+        ----------
+        cluster_track_ids : list of numpy array(n_clusters) of int
+            Track id of each cluster, one array per frame
+        cluster_lifetimes : numpy structured array
+            One row per track with fields track, first_frame,
+            last_frame, n_frames, lifetime and complete (True if the
+            track starts and ends within the analysed frames)
+        fusion_events, fission_events : numpy structured array
+            One row per event with fields frame, time, cluster, size
+            and n_fragments. For fusions cluster is the label of the
+            merged cluster at frame, for fissions the label of the
+            splitting cluster at frame - 1.
+        exchange_events : numpy structured array
+            One row per exchange with fields frame, time, cluster_from
+            (label at frame - 1), cluster_to (label at frame) and
+            n_molecules
+        """
+        labels = self.cluster_list.labels
+        times = self.cluster_list.times
+
+        # Without frames there are no tracks, all tables stay empty
+        n_clusters_first = (self.cluster_list.n_clusters(0)
+                            if len(self.cluster_list) > 0 else 0)
+        self.cluster_track_ids = [np.arange(n_clusters_first)]
+        n_tracks = len(self.cluster_track_ids[0])
+        # Start from empty tables so that concatenating always works
+        fusion_events = [self._event_table(0, 0.0, [], [], [])]
+        fission_events = [self._event_table(0, 0.0, [], [], [])]
+        exchange_events = [self._exchange_table(0, 0.0, [], [], [])]
+
+        for frame in range(1, len(self.cluster_list)):
+            (clusters_from, clusters_to, n_shared, is_continuation,
+             n_clusters_to) = self._match_clusters(labels[frame - 1], labels[frame])
+
+            # Continuing clusters keep their track id, all others
+            # start a new track
+            track_ids = np.full(n_clusters_to, -1)
+            track_ids[clusters_to[is_continuation]] = \
+                self.cluster_track_ids[-1][clusters_from[is_continuation]]
+            is_new_track = track_ids == -1
+            track_ids[is_new_track] = np.arange(
+                n_tracks, n_tracks + np.count_nonzero(is_new_track)
+            )
+            n_tracks += np.count_nonzero(is_new_track)
+            self.cluster_track_ids.append(track_ids)
+
+            is_fragment = n_shared >= min_fragment
+
+            n_fragments_from = np.bincount(clusters_from[is_fragment])
+            fission = np.flatnonzero(n_fragments_from > 1)
+            fission_events.append(self._event_table(
+                frame, times[frame], fission,
+                np.bincount(labels[frame - 1])[fission], n_fragments_from[fission]
+            ))
+
+            n_fragments_to = np.bincount(clusters_to[is_fragment])
+            fusion = np.flatnonzero(n_fragments_to > 1)
+            fusion_events.append(self._event_table(
+                frame, times[frame], fusion,
+                np.bincount(labels[frame])[fusion], n_fragments_to[fusion]
+            ))
+
+            is_exchange = ~is_fragment & ~is_continuation
+            exchange_events.append(self._exchange_table(
+                frame, times[frame], clusters_from[is_exchange],
+                clusters_to[is_exchange], n_shared[is_exchange]
+            ))
+
+        self.fusion_events = np.concatenate(fusion_events)
+        self.fission_events = np.concatenate(fission_events)
+        self.exchange_events = np.concatenate(exchange_events)
+
+        # Lifetime of each track from the first and last frame it exists
+        track_ids = np.concatenate(self.cluster_track_ids)
+        track_frames = np.repeat(
+            np.arange(len(self.cluster_track_ids)),
+            [len(ids) for ids in self.cluster_track_ids]
+        )
+        self.cluster_lifetimes = np.zeros(n_tracks, dtype=[
+            ("track", int), ("first_frame", int), ("last_frame", int),
+            ("n_frames", int), ("lifetime", float), ("complete", bool)
+        ])
+        self.cluster_lifetimes["track"] = np.arange(n_tracks)
+        self.cluster_lifetimes["first_frame"] = len(self.cluster_track_ids)
+        np.minimum.at(self.cluster_lifetimes["first_frame"], track_ids, track_frames)
+        np.maximum.at(self.cluster_lifetimes["last_frame"], track_ids, track_frames)
+        self.cluster_lifetimes["n_frames"] = np.bincount(track_ids, minlength=n_tracks)
+        self.cluster_lifetimes["lifetime"] = (
+            times[self.cluster_lifetimes["last_frame"]]
+            - times[self.cluster_lifetimes["first_frame"]]
+        )
+        self.cluster_lifetimes["complete"] = (
+            (self.cluster_lifetimes["first_frame"] > 0)
+            & (self.cluster_lifetimes["last_frame"] < len(self.cluster_track_ids) - 1)
+        )
+
+        print("****TRACKING:")
+        print("Number of tracks: {:d}".format(n_tracks))
+        print("Number of fusions: {:d}".format(len(self.fusion_events)))
+        print("Number of fissions: {:d}".format(len(self.fission_events)))
+        print("Number of exchanges: {:d}".format(len(self.exchange_events)))
+
+    def _match_clusters(self, labels_from, labels_to):
+        """Match the clusters of two consecutive frames by shared species
+
+        Parameters
+        ----------
+        labels_from : numpy array(n_species) of int
+            Cluster labels of the earlier frame
+        labels_to : numpy array(n_species) of int
+            Cluster labels of the later frame
+
+        Returns
+        -------
+        clusters_from : numpy array(m) of int
+        clusters_to : numpy array(m) of int
+            Labels of all pairs of clusters sharing at least one species
+        n_shared : numpy array(m) of int
+            Number of species shared by each pair
+        is_continuation : numpy array(m) of bool
+            True for pairs whose clusters share most of their species
+            with each other (ties go to the lower label)
+        n_clusters_to : integer
+            Number of clusters in the later frame
+        """
+        n_clusters_from = labels_from.max() + 1
+        n_clusters_to = labels_to.max() + 1
+
+        overlap = scipy.sparse.coo_matrix(
+            (np.ones(len(labels_from), dtype=int), (labels_from, labels_to)),
+            shape=(n_clusters_from, n_clusters_to),
+        ).tocsr().tocoo()
+        clusters_from = overlap.row
+        clusters_to = overlap.col
+        n_shared = overlap.data
+
+        # Pair with the largest overlap of each earlier cluster ...
+        order = np.lexsort((clusters_to, -n_shared, clusters_from))
+        _, first = np.unique(clusters_from[order], return_index=True)
+        is_best_to = np.zeros(len(n_shared), dtype=bool)
+        is_best_to[order[first]] = True
+
+        # ... and of each later cluster
+        order = np.lexsort((clusters_from, -n_shared, clusters_to))
+        _, first = np.unique(clusters_to[order], return_index=True)
+        is_best_from = np.zeros(len(n_shared), dtype=bool)
+        is_best_from[order[first]] = True
+
+        return (clusters_from, clusters_to, n_shared,
+                is_best_to & is_best_from, n_clusters_to)
+
+    def _event_table(self, frame, time, clusters, sizes, n_fragments):
+        """Build a table of fusion or fission events
+
+        Parameters
+        ----------
+        frame : integer
+        time : float
+        clusters : numpy array(m) of int
+            Labels of the fusing or splitting clusters
+        sizes : numpy array(m) of int
+            Size of each of these clusters
+        n_fragments : numpy array(m) of int
+            Number of fragments of each event
+
+        Returns
+        -------
+        events : numpy structured array(m)
+        """
+        events = np.zeros(len(clusters), dtype=[
+            ("frame", int), ("time", float), ("cluster", int),
+            ("size", int), ("n_fragments", int)
+        ])
+        events["frame"] = frame
+        events["time"] = time
+        events["cluster"] = clusters
+        events["size"] = sizes
+        events["n_fragments"] = n_fragments
+
+        return events
+
+    def _exchange_table(self, frame, time, clusters_from, clusters_to,
+                        n_molecules):
+        """Build a table of exchange events
+
+        Parameters
+        ----------
+        frame : integer
+        time : float
+        clusters_from : numpy array(m) of int
+            Labels of the clusters the molecules leave
+        clusters_to : numpy array(m) of int
+            Labels of the clusters the molecules join
+        n_molecules : numpy array(m) of int
+            Number of exchanged molecules
+
+        Returns
+        -------
+        events : numpy structured array(m)
+        """
+        events = np.zeros(len(clusters_from), dtype=[
+            ("frame", int), ("time", float), ("cluster_from", int),
+            ("cluster_to", int), ("n_molecules", int)
+        ])
+        events["frame"] = frame
+        events["time"] = time
+        events["cluster_from"] = clusters_from
+        events["cluster_to"] = clusters_to
+        events["n_molecules"] = n_molecules
+
+        return events
+
+    def cluster_size_distribution(self, frames=(0, None, 1), weighting="number"):
+        """Get the cluster size distribution accumulated over frames
+
+        The cluster sizes of each frame are counted with bincount on
+        the stored cluster labels and added to a running histogram, so
+        memory does not grow with the number of frames.
+
+        Example
+        -------
+        sizes, distribution, n_w = ClstrEns.cluster_size_distribution(
+            frames=(0, 100, 1), weighting="monomer")
+
+        Parameters
+        ----------
+        frames : tuple of int, optional
+            (first frame, last frame, stepsize to go through frames),
+            by default all frames
+        weighting : string, optional
+            "number", "monomer" or "mass". Each cluster contributes 1,
+            its number of monomers or its mass respectively to the
+            distribution at its size.
+
+        Returns
+        -------
+        sizes : numpy array(max_size) of int
+            Cluster sizes from 1 to the largest size found
+        distribution : numpy array(max_size)
+            Summed weight of all clusters of each size over the frames
+        running_weight_average : numpy array(n_frames)
+            Weight average aggregation number sum(s^2 n_s)/sum(s n_s)
+            of all frames up to and including each frame
+
+        Raises
+        ------
+        NotImplementedError
+            If an unspecified weighting is choosen
+        """
+        if weighting == "mass":
+            species_masses = self.cluster_list.species.masses
+        elif weighting not in ("number", "monomer"):
+            raise NotImplementedError(
+                "{:s} is unspecified weighting".format(weighting)
+            )
+
+        distribution = np.zeros(1)
+        running_weight_average = []
+        sum_size2 = 0.0
+        sum_size = 0.0
+
+        for frame in range(len(self.cluster_list))[slice(*frames)]:
+            labels = self.cluster_list.labels[frame]
+            cluster_sizes = np.bincount(labels)
+
+            if weighting == "number":
+                cluster_weights = None
+            elif weighting == "monomer":
+                cluster_weights = cluster_sizes
+            elif weighting == "mass":
+                cluster_weights = np.bincount(labels, weights=species_masses)
+
+            frame_distribution = np.bincount(cluster_sizes, weights=cluster_weights)
+            if len(frame_distribution) > len(distribution):
+                distribution = np.pad(
+                    distribution, (0, len(frame_distribution) - len(distribution))
+                )
+            distribution[:len(frame_distribution)] += frame_distribution
+
+            sum_size2 += np.sum(cluster_sizes.astype(float)**2)
+            sum_size += len(labels)
+            running_weight_average.append(sum_size2 / sum_size)
+
+        sizes = np.arange(1, len(distribution))
+
+        return sizes, distribution[1:], np.asarray(running_weight_average)
+
     def plot_histogram(
         self,
         ax,
@@ -368,6 +1317,7 @@ class ClusterEnsemble(BaseUniverse):
         maxbins=False,
         density=True,
         filename=None,
+        weighting="number",
         *args,
         **kwargs
     ):
@@ -398,6 +1348,9 @@ class ClusterEnsemble(BaseUniverse):
         filename : string, optional
             If string is given, save the plot under that name. Specify
             if you want pdf, png etc..
+        weighting : string, optional
+            "number", "monomer" or "mass", see
+            cluster_size_distribution
 
         Returns
         -------
@@ -417,20 +1370,24 @@ class ClusterEnsemble(BaseUniverse):
             )
 
         # Get the size distribution of all frames for all frames
-        masterlist = []
+        sizes_list = []
+        distribution_list = []
         for frames_i in frames:
-            masterlist.append(self._get_cluster_distribution(frames_i))
+            sizes, distribution, _ = self.cluster_size_distribution(
+                frames=frames_i, weighting=weighting
+            )
+            sizes_list.append(sizes)
+            distribution_list.append(distribution)
 
         # By making as many bins as molecules in the largest cluster
         # there is a bar for each clustersize
         if maxbins is True:
-            bins = max(
-                [max(cluster_distribution) for cluster_distribution in masterlist]
-            )
+            bins = max([len(sizes) for sizes in sizes_list])
         else:
             bins = None
 
-        ax.hist(masterlist, bins=bins, density=density, *args, **kwargs)
+        ax.hist(sizes_list, bins=bins, density=density,
+                weights=distribution_list, *args, **kwargs)
 
         ax.set_xlabel("Number of Monomers")
         if not density is True:
@@ -444,22 +1401,47 @@ class ClusterEnsemble(BaseUniverse):
         else:
             plt.savefig(filename)
 
-    def _get_cluster_distribution(self, frames):
-        """Helper for plot_histogram to get a cluster distribution
 
-        Parameters
-        ----------
-        frames : tuple of int
-            first frame, last frame and stepsize
+def _init_cluster_worker(coord, traj, selection, pbc_style, kwargs):
+    """Set up the ClusterEnsemble of a worker process of cluster_analysis
 
-        Returns
-        -------
-        cluster_distribution: list of int
-            All the clusterssizes in all the frames specified
-        """
-        cluster_distribution = []
-        for frame in self.cluster_list[slice(*frames)]:
-            for cluster in frame:
-                cluster_distribution.append(len(cluster))
+    Parameters
+    ----------
+    coord : string
+        Path to a coordinate-like file
+    traj : string
+        Path to a trajectory like file
+    selection : list of string
+        Cluster objects of the ClusterEnsemble
+    pbc_style : string or None
+        Pbc style of the ClusterEnsemble
+    kwargs : dict
+        Keyword arguments of ClusterEnsemble._init_cluster_analysis
+    """
+    global _worker_cluster_ensemble, _worker_cluster_algorithm
 
-        return cluster_distribution
+    _worker_cluster_ensemble = ClusterEnsemble(coord, traj, selection)
+    _worker_cluster_ensemble._set_pbc_style(pbc_style)
+    _worker_cluster_algorithm = _worker_cluster_ensemble._init_cluster_analysis(
+        **kwargs
+    )
+
+
+def _cluster_frame_block(frame_block, cut_off):
+    """Cluster a block of frames in a worker process of cluster_analysis,
+    see _init_cluster_worker
+
+    Parameters
+    ----------
+    frame_block : numpy array of int
+        Indices of the frames of the block
+    cut_off : float
+
+    Returns
+    -------
+    block_result : list of (float, numpy array(n_species) of int32)
+        Time and cluster labels of each clustered frame
+    """
+    return _worker_cluster_ensemble._cluster_frame_block(
+        _worker_cluster_algorithm, frame_block, cut_off=cut_off
+    )
@@ -0,0 +1,156 @@
+import numpy as np
+
+
+class ClusterTrajectory():
+    """Compact store of the clusters found for every frame of a trajectory
+
+    The clusters of a frame are stored as one int32 cluster label per
+    species (molecule or atom), all frames together in one contiguous
+    (n_frames, n_species) array which can be memory-mapped to a .npy
+    file. ResidueGroups or AtomGroups of the clusters are only built
+    when a frame is accessed.
+
+    Attributes
+    ----------
+    species : MDAnalysis ResidueGroup or AtomGroup
+        The residues or atoms which are clustered, in order of the
+        label columns.
+    n_frames : integer
+        Number of frames stored so far.
+
+    Methods
+    -------
+    append(labels, time)
+        Store the cluster labels of the next frame.
+    clusters(frame)
+        List of ResidueGroups or AtomGroups of a frame.
+    cluster_sizes(frame)
+        Number of species in each cluster of a frame.
+    n_clusters(frame)
+        Number of clusters in a frame.
+    """
+
+    def __init__(self, species, max_frames, filename=None):
+        """
+        Parameters
+        ----------
+        species : MDAnalysis ResidueGroup or AtomGroup
+            The residues or atoms which are clustered
+        max_frames : integer
+            Maximum number of frames which can be stored
+        filename : string, optional
+            If given, the labels are memory-mapped to this .npy file
+            instead of being kept in memory. The file can be loaded
+            with numpy.load afterwards.
+        """
+        self.species = species
+        self.n_frames = 0
+        self.filename = filename
+
+        shape = (max_frames, len(species))
+        if filename is None:
+            self._labels = np.empty(shape, dtype=np.int32)
+        else:
+            self._labels = np.lib.format.open_memmap(
+                filename, mode="w+", dtype=np.int32, shape=shape
+            )
+        self._times = np.empty(max_frames)
+
+    @property
+    def labels(self):
+        """numpy array(n_frames, n_species) of int32: cluster label of each
+        species in each frame, ordered by the first species of each
+        cluster"""
+        return self._labels[:self.n_frames]
+
+    @property
+    def times(self):
+        """numpy array(n_frames): time of each frame"""
+        return self._times[:self.n_frames]
+
+    def append(self, labels, time):
+        """Store the cluster labels of the next frame
+
+        Parameters
+        ----------
+        labels : numpy array(n_species) of int
+            Cluster label of each species
+        time : float
+            Time of the frame
+
+        Raises
+        ------
+        IndexError
+            If max_frames frames are already stored
+        """
+        if self.n_frames == len(self._labels):
+            raise IndexError("ClusterTrajectory is full ({:d} frames)".format(
+                self.n_frames))
+
+        self._labels[self.n_frames] = labels
+        self._times[self.n_frames] = time
+        self.n_frames += 1
+
+    def flush(self):
+        """Write the labels to disk if they are memory-mapped
+        """
+        if self.filename is not None:
+            self._labels.flush()
+
+    def clusters(self, frame):
+        """Build the clusters of a single frame
+
+        Parameters
+        ----------
+        frame : integer
+
+        Returns
+        -------
+        cluster_list : list of ResGroups or AtomGroups
+            One group per cluster, in order of the labels
+        """
+        labels = self.labels[frame]
+        order = np.argsort(labels, kind="stable")
+        boundaries = np.cumsum(np.bincount(labels))[:-1]
+
+        return [self.species[indices] for indices in np.split(order, boundaries)]
+
+    def cluster_sizes(self, frame):
+        """Get the size of every cluster of a single frame
+
+        Parameters
+        ----------
+        frame : integer
+
+        Returns
+        -------
+        cluster_sizes : numpy array(n_clusters) of int
+            Number of molecules or atoms in each cluster
+        """
+        return np.bincount(self.labels[frame])
+
+    def n_clusters(self, frame):
+        """Get the number of clusters of a single frame
+
+        Parameters
+        ----------
+        frame : integer
+
+        Returns
+        -------
+        n_clusters : integer
+        """
+        return int(self.labels[frame].max()) + 1
+
+    def __len__(self):
+        return self.n_frames
+
+    def __getitem__(self, frame):
+        if isinstance(frame, slice):
+            return [self.clusters(i) for i in range(self.n_frames)[frame]]
+
+        return self.clusters(frame)
+
+    def __iter__(self):
+        for frame in range(self.n_frames):
+            yield self.clusters(frame)
@@ -0,0 +1,179 @@
+import numpy as np
+
+
+class DisjointSet():
+    """Array backed disjoint-set (union-find) over integer elements
+
+    Every element is an index between 0 and n_elements-1. Each set is
+    represented by its root. Pairs of elements can be merged in bulk
+    with NumPy operations instead of one Python call per pair, or one
+    group at a time with union by size and path halving, which takes
+    near-constant amortized time per element.
+
+    Attributes
+    ----------
+    parent : numpy array(n) of int
+        Parent of each element, roots are their own parent.
+    size : numpy array(n) of int
+        Number of elements in the set of each root.
+
+    Methods
+    -------
+    find(element)
+        Root of the set of a single element.
+    union(element_i, element_j)
+        Merge the sets of two elements.
+    union_group(elements)
+        Merge the sets of all elements into one.
+    union_pairs(elements_i, elements_j)
+        Merge the sets of all pairs (elements_i[k], elements_j[k]).
+    roots()
+        Root of every element.
+    labels()
+        Consecutive set labels ordered by the smallest element of
+        each set.
+    """
+
+    def __init__(self, n_elements):
+        """
+        Parameters
+        ----------
+        n_elements : integer
+            Number of elements, each one starts in its own set.
+        """
+        self.parent = np.arange(n_elements, dtype=np.intp)
+        self.size = np.ones(n_elements, dtype=np.intp)
+
+    def find(self, element):
+        """Get the root of a single element, halving the path on the way
+
+        Parameters
+        ----------
+        element : integer
+
+        Returns
+        -------
+        root : integer
+        """
+        parent = self.parent
+        while parent[element] != element:
+            parent[element] = parent[parent[element]]
+            element = parent[element]
+
+        return element
+
+    def union(self, element_i, element_j):
+        """Merge the sets of two elements, the smaller set is attached to
+        the root of the larger one
+
+        Parameters
+        ----------
+        element_i : integer
+        element_j : integer
+
+        Returns
+        -------
+        root : integer
+            Root of the merged set
+        """
+        root_i = self.find(element_i)
+        root_j = self.find(element_j)
+        if root_i == root_j:
+            return root_i
+
+        if self.size[root_i] < self.size[root_j]:
+            root_i, root_j = root_j, root_i
+        self.parent[root_j] = root_i
+        self.size[root_i] += self.size[root_j]
+
+        return root_i
+
+    def union_group(self, elements):
+        """Merge the sets of all elements into one set
+
+        Parameters
+        ----------
+        elements : iterable of int
+        """
+        elements = iter(elements)
+        root = next(elements, None)
+        for element in elements:
+            root = self.union(root, element)
+
+    def _compress(self):
+        """Point every element directly at its root (pointer jumping)
+        """
+        parent = self.parent
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+        self.parent = parent
+
+    def union_pairs(self, elements_i, elements_j):
+        """Merge the sets connected by the pairs (elements_i, elements_j)
+
+        Each pass hooks the larger root of every unmerged pair onto the
+        smallest root it is paired with and then compresses all paths.
+        Pairs which already share a root are dropped, so the number of
+        passes is small even for large, densely connected sets.
+
+        Parameters
+        ----------
+        elements_i : numpy array(m) of int
+        elements_j : numpy array(m) of int
+        """
+        elements_i = np.asarray(elements_i, dtype=np.intp)
+        elements_j = np.asarray(elements_j, dtype=np.intp)
+
+        self._compress()
+        while elements_i.size > 0:
+            root_i = self.parent[elements_i]
+            root_j = self.parent[elements_j]
+
+            # Only pairs in different sets still need merging
+            unmerged = root_i != root_j
+            elements_i = elements_i[unmerged]
+            elements_j = elements_j[unmerged]
+            root_i = root_i[unmerged]
+            root_j = root_j[unmerged]
+            if elements_i.size == 0:
+                break
+
+            high = np.maximum(root_i, root_j)
+            low = np.minimum(root_i, root_j)
+            np.minimum.at(self.parent, high, low)
+
+            self._compress()
+
+        self.size = np.bincount(self.parent, minlength=len(self.parent))
+
+    def roots(self):
+        """Get the root of every element
+
+        Returns
+        -------
+        roots : numpy array(n) of int
+            Root of the set each element belongs to
+        """
+        self._compress()
+        return self.parent.copy()
+
+    def labels(self):
+        """Get consecutive set labels
+
+        Returns
+        -------
+        labels : numpy array(n) of int
+            Label of the set of each element. Labels start at 0 and
+            are ordered by the smallest element of each set.
+        """
+        _, first_element, labels = np.unique(
+            self.roots(), return_index=True, return_inverse=True
+        )
+        # Relabel the sets in order of their smallest element
+        order = np.empty(len(first_element), dtype=np.intp)
+        order[np.argsort(first_element)] = np.arange(len(first_element))
+
+        return order[labels.reshape(-1)]
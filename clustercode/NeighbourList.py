@@ -0,0 +1,199 @@
+import MDAnalysis.lib.distances as distances
+import MDAnalysis.lib.mdamath as mdamath
+import numpy as np
+
+
+class NeighbourList():
+    """Verlet neighbour list of a set of positions shared across frames
+
+    All pairs within cut_off + skin are searched once and kept as
+    candidate pairs. As long as no position moved further than skin/2
+    since that search, every pair within cut_off is a candidate pair, so
+    later frames only need the distances of the candidate pairs instead
+    of a new search.
+
+    Positions are followed in fractional (box) coordinates, so the
+    candidate pairs rescale with the box in NPT simulations. A change
+    of the box by the strain e changes a distance r by at most e*r, this
+    is taken into account when deciding if the candidate pairs are
+    still complete, and the pairs are only searched again if the strain
+    exceeds box_tolerance or uses up the skin.
+
+    Attributes
+    ----------
+    cut_off : float
+        Radius of the pairs returned by get_pairs
+    skin : float
+        Additional radius of the candidate pairs
+    candidate_pairs : numpy array(m,2) of int
+        Pairs of position indices within cut_off + skin in the
+        reference frame
+    reference_distances : numpy array(m)
+        Distances of the candidate pairs in the reference frame
+    displacement : numpy array(n)
+        Distance of each position from its reference position, not
+        counting the rescaling of the box
+    strain : float
+        Relative deformation of the box since the reference frame
+    n_builds : integer
+        Number of searches done so far
+
+    Methods
+    -------
+    update(positions, box=None)
+        Search the candidate pairs again if positions moved too far.
+    get_pairs(positions, box=None)
+        All pairs within cut_off.
+    """
+
+    def __init__(self, cut_off, skin=2.0, groups=None, box_tolerance=0.02):
+        """
+        Parameters
+        ----------
+        cut_off : float
+            Radius of the pairs returned by get_pairs
+        skin : float, optional
+            Additional radius of the candidate pairs. A skin of 0
+            searches all pairs again in every frame.
+        groups : numpy array(n) of int, optional
+            Group index of every position, pairs within the same group
+            are never listed (e.g. atoms of the same molecule).
+        box_tolerance : float, optional
+            Maximum strain of the box before the pairs are searched
+            again, by default 0.02
+        """
+        self.cut_off = cut_off
+        self.skin = skin
+        self.groups = groups
+        self.box_tolerance = box_tolerance
+        self.n_builds = 0
+
+        self._reference_positions = None
+        self._reference_box = None
+
+    def update(self, positions, box=None):
+        """Search the candidate pairs again if it is needed
+
+        Parameters
+        ----------
+        positions : numpy array(n,3)
+        box : numpy array(6), optional
+            Box dimensions for periodic boundary conditions
+
+        Returns
+        -------
+        rebuilt : bool
+            True if the candidate pairs were searched again, this
+            frame is then the new reference frame.
+        """
+        if self._needs_build(positions, box):
+            self._build(positions, box)
+            return True
+
+        return False
+
+    def get_pairs(self, positions, box=None):
+        """Get all pairs within cut_off
+
+        Parameters
+        ----------
+        positions : numpy array(n,3)
+        box : numpy array(6), optional
+            Box dimensions for periodic boundary conditions
+
+        Returns
+        -------
+        pairs : numpy array(k,2) of int
+            Pairs of position indices within cut_off
+        """
+        if self.update(positions, box):
+            return self.candidate_pairs[self.reference_distances <= self.cut_off]
+
+        pair_distances = distances.calc_bonds(
+            positions[self.candidate_pairs[:, 0]],
+            positions[self.candidate_pairs[:, 1]],
+            box=box,
+        )
+
+        return self.candidate_pairs[pair_distances <= self.cut_off]
+
+    def _needs_build(self, positions, box):
+        """Check if the candidate pairs may miss a pair within cut_off and
+        update the displacement of all positions and the strain of the
+        box
+
+        Parameters
+        ----------
+        positions : numpy array(n,3)
+        box : numpy array(6) or None
+
+        Returns
+        -------
+        needs_build : bool
+        """
+        if self._reference_positions is None:
+            return True
+        if (box is None) != (self._reference_box is None):
+            return True
+
+        if box is None:
+            self.strain = 0.0
+            self.displacement = np.linalg.norm(
+                positions - self._reference_positions, axis=1
+            )
+        else:
+            box_vectors = mdamath.triclinic_vectors(box)
+
+            # Deformation of the box since the reference frame, for row
+            # vectors v_now = v_ref @ deformation
+            deformation = np.linalg.solve(self._reference_box_vectors, box_vectors)
+            identity = np.identity(3)
+            self.strain = max(
+                np.linalg.norm(deformation - identity, 2),
+                np.linalg.norm(np.linalg.inv(deformation) - identity, 2),
+            )
+            if self.strain > self.box_tolerance:
+                return True
+
+            # Displacement in fractional coordinates with minimum image
+            fractional_shift = (np.matmul(positions, np.linalg.inv(box_vectors))
+                                - self._reference_fractional)
+            fractional_shift -= np.round(fractional_shift)
+            self.displacement = np.linalg.norm(
+                np.matmul(fractional_shift, box_vectors), axis=1
+            )
+
+        # Unlisted pairs were further apart than cut_off + skin
+        return (2.0 * self.displacement.max()
+                + self.strain * (self.cut_off + self.skin) > self.skin)
+
+    def _build(self, positions, box):
+        """Search all pairs within cut_off + skin and make this frame the
+        reference frame
+
+        Parameters
+        ----------
+        positions : numpy array(n,3)
+        box : numpy array(6) or None
+        """
+        pairs, pair_distances = distances.self_capped_distance(
+            positions, self.cut_off + self.skin, box=box
+        )
+        if self.groups is not None:
+            different_groups = (self.groups[pairs[:, 0]]
+                                != self.groups[pairs[:, 1]])
+            pairs = pairs[different_groups]
+            pair_distances = pair_distances[different_groups]
+
+        self.candidate_pairs = pairs
+        self.reference_distances = pair_distances
+        self.displacement = np.zeros(len(positions))
+        self.strain = 0.0
+        self._reference_positions = positions.copy()
+        self._reference_box = None if box is None else box.copy()
+        if box is not None:
+            self._reference_box_vectors = mdamath.triclinic_vectors(box)
+            self._reference_fractional = np.matmul(
+                positions, np.linalg.inv(self._reference_box_vectors)
+            )
+        self.n_builds += 1
@@ -6,9 +6,13 @@ import matplotlib as mlp
 import matplotlib.pyplot as plt
 import numpy as np
 import sys
-import itertools
+import collections
 import scipy
+import scipy.fft
+import scipy.linalg.blas
+from multiprocessing.pool import ThreadPool
 from clustercode.BaseUniverse import BaseUniverse
+from clustercode.StructureFactorAccumulator import StructureFactorAccumulator
 
 
 #from MDAnalysis.core.groups import ResidueGroup
@@ -40,7 +44,7 @@ class OrderParameterEnsemble(BaseUniverse):
         timesteps. 
     translational_op_analysis(self, director, times=None, style="molecule", pbc_style=None, pos_style="com", search_param=None, custom_traj=None)
         Calculates translational order parameter and translational spacing for input director or list of directors.
-    structure_factor_analysis(self, directors=None, times=None, style="molecule", pbc_style=None, pos_style="com", q_style="strict", q_min=0, q_max=1, q_step = 0.01, active_dim=[1,1,1], custom_traj=None, plot_style="scatter", chunk_size=10000, n_bins = 500)
+    structure_factor_analysis(self, directors=None, times=None, style="molecule", pbc_style=None, pos_style="com", q_style="strict", q_min=0, q_max=1, q_step = 0.01, active_dim=[1,1,1], custom_traj=None, plot_style="scatter", chunk_size=None, n_bins = 1000, raw_output=None, n_threads=1, overwrite_raw_output=False)
         Calculates structure factor as a function of the wave vector.
 
     """
@@ -60,7 +64,18 @@ class OrderParameterEnsemble(BaseUniverse):
         """
         super().__init__(coord, traj, selection)
 
-    def nematic_op_analysis(self, times=None, style="molecule", principal_axis="inertial", custom_traj=None, pbc_style=None):
+        # Masses of the last CSR layout used, see _get_group_masses
+        self._mass_indices = None
+        self._group_masses = None
+
+        # Least recently used cache of wave vector sets, see _get_q_array
+        self._q_cache = collections.OrderedDict()
+        self._q_cache_size = 16
+        # Miller indices of the last strict enumeration, see _get_miller_indices
+        self._miller_n_max = None
+        self._miller_indices = None
+
+    def nematic_op_analysis(self, times=None, style="molecule", principal_axis="inertial", custom_traj=None, pbc_style=None, start=None, stop=None, step=None, frames=None):
         """High level function for calculating the nematic order parameter
         
         Example
@@ -82,7 +97,11 @@ class OrderParameterEnsemble(BaseUniverse):
         custom_traj : list of list of AtomGroup, optional
             To be specified if the analysis is to be applied to clusters or other custom AtomGroups (i.e. if you want to consider different parts of the same molecule separately). The list should be the same length as the trajectory, each list of AtomGroups representing a trajectory timestep.
         pbc_style : string, optional
-            Gromacs pbc definitions: mol, atom, nojump
+            Gromacs pbc definitions: whole, mol, res, atom, nojump. Applied to every frame as it is read.
+        start, stop, step : integer, optional
+            Only analyse the frames trajectory[start:stop:step], by default all frames. Frames outside are never read.
+        frames : list of integer, optional
+            Indices of the frames to analyse, instead of start, stop and step. times is applied on top of either.
 
         Raises
         ------ 
@@ -98,9 +117,36 @@ class OrderParameterEnsemble(BaseUniverse):
 
         self.universe = self._get_universe(self._coord, traj=self._traj)
 
-        self.selected_species = self._select_species(self.universe,
-                                                            style=style)
-        self._custom_traj_check(times, custom_traj)
+        frame_indices = self._get_frame_indices(times=times, start=start, stop=stop, step=step, frames=frames)
+
+        self._prepare_nematic_op(frame_indices, style=style, principal_axis=principal_axis, custom_traj=custom_traj)
+
+        # Loop over the selected frames, the others are never read
+        for frame_number, time in enumerate(self.universe.trajectory[frame_indices]):
+            self._nematic_op_single_frame(time, frame_number)
+
+        self._conclude_nematic_op()
+
+        # Rewind Trajectory to beginning for other analysis
+        self.universe.trajectory.rewind()
+
+    def _prepare_nematic_op(self, frame_indices, style="molecule", principal_axis="inertial", custom_traj=None):
+        """ Check the input of the nematic order parameter analysis and initialise its outputs
+
+        Parameters
+        ----------
+        frame_indices : numpy array of int
+            Indices of the frames analysed
+        style, principal_axis, custom_traj
+            See nematic_op_analysis
+
+        Raises
+        ------ 
+        NotImplementedError
+            If an unspecified principal axis is choosen
+        """
+        self.selected_species = self._select_species(self.universe, style=style)
+        self._custom_traj_check(frame_indices, custom_traj)
 
         # Select which principal axis in the AtomGroup to use
         if principal_axis == "inertial":
@@ -110,41 +156,48 @@ class OrderParameterEnsemble(BaseUniverse):
         else:
             raise NotImplementedError("{:s} is unspecified molecular axis".format(principal_axis))
 
-        # If custom_traj is not specified initialise select_species as a list of AtomGroups (one for each residue)
+        # If custom_traj is not specified the selected species of each residue are used, compiled once into flat index arrays
+        self._nematic_custom_traj = custom_traj
         if custom_traj is None:
-            selected_species_list = [self._select_species(residue.atoms, style=style) for residue in self.selected_species.residues]
+            self._nematic_species_index = self._compile_species(style)
 
         # Initialise outputs
         self.nematic_op_list = []
         self.system_director_list = []
-        sum_saupe_tensor = np.zeros((3,3))
+        self._sum_saupe_tensor = np.zeros((3,3))
 
-        # Loop over all trajectory times
-        for time in self.universe.trajectory:
-            if times is not None:
-                if time.time > max(times) or time.time < min(times):
-                    continue
-            
-            # Either use custrom_traj or the selected species
-            if custom_traj is not None:
-                atom_group_list = custom_traj[self.custom_traj_idx]
-                self.custom_traj_idx+= 1
-            else:
-                atom_group_list = selected_species_list
+    def _nematic_op_single_frame(self, time, frame_number):
+        """ Calculate the nematic order parameter and system director of the current frame
+
+        Parameters
+        ----------
+        time : MDAnalysis Timestep
+            Current frame
+        frame_number : integer
+            Position of the frame in the analysed frames
+        """
+        # Either use custrom_traj or the selected species
+        if self._nematic_custom_traj is not None:
+            atom_indices, offsets = self._get_group_indices(self._nematic_custom_traj[frame_number])
+        else:
+            atom_indices, offsets = self._nematic_species_index
 
-            principal_axis_list = self.principal_axis(atom_group_list)
-            saupe_tensor = self._get_saupe_tensor(principal_axis_list)
-            nematic_op, system_director = self._get_dominant_eig(saupe_tensor)
+        principal_axis_list = self.principal_axis(atom_indices, offsets)
+        saupe_tensor = self._get_saupe_tensor(principal_axis_list)
+        nematic_op, system_director = self._get_dominant_eig(saupe_tensor)
 
-            self.nematic_op_list.append(nematic_op)
-            self.system_director_list.append(system_director)
-            sum_saupe_tensor += saupe_tensor
+        self.nematic_op_list.append(nematic_op)
+        self.system_director_list.append(system_director)
+        self._sum_saupe_tensor += saupe_tensor
 
-            print("****TIME: {:8.2f}".format(time.time))
-            print("Nematic order parameter: {:.3f}".format(nematic_op))
-            
+        print("****TIME: {:8.2f}".format(time.time))
+        print("Nematic order parameter: {:.3f}".format(nematic_op))
+
+    def _conclude_nematic_op(self):
+        """ Calculate the ensemble averages of the nematic order parameter analysis
+        """
         # Obtain the ensemble average saupe_tensor
-        self.ensemble_saupe_tensor = sum_saupe_tensor/len(self.nematic_op_list)
+        self.ensemble_saupe_tensor = self._sum_saupe_tensor/len(self.nematic_op_list)
 
         # Calculate the mean nematic order parameter and system director from the ensemble average saupe tensor
         self.mean_nematic_op, self.mean_system_director = self._get_dominant_eig(self.ensemble_saupe_tensor)
@@ -155,10 +208,7 @@ class OrderParameterEnsemble(BaseUniverse):
         print("Mean nematic order parameter: {:.3f} +/- {:.3f}".format(self.mean_nematic_op,self.stdev_nematic_op))
         print("Mean system director: {:s}".format(np.array2string(self.mean_system_director)))
 
-        # Rewind Trajectory to beginning for other analysis
-        self.universe.trajectory.rewind()
-
-    def translational_op_analysis(self, director, times=None, style="molecule",pbc_style=None, pos_style="com", search_param=[0.1, 50, 500], custom_traj=None, plot=False):
+    def translational_op_analysis(self, director, times=None, style="molecule",pbc_style=None, pos_style="com", search_param=[0.1, 50, 500], custom_traj=None, plot=False, start=None, stop=None, step=None, frames=None, unwrap=False):
         """High level function for calculating the translational order parameter
         
         Example
@@ -178,7 +228,7 @@ class OrderParameterEnsemble(BaseUniverse):
             cluster_objects attribute is interpreted as molecule
             or atoms within a molecule. 
         pbc_style : string, optional
-            Gromacs pbc definitions: mol, atom, nojump
+            Gromacs pbc definitions: whole, mol, res, atom, nojump. Applied to every frame as it is read.
        pos_style : string, optional
             Center of mass ("com") or "atom"
         search_space : [float, float, int], optional
@@ -187,6 +237,12 @@ class OrderParameterEnsemble(BaseUniverse):
             To be specified if the analysis is to be applied to clusters or other custom AtomGroups (i.e. if you want to consider different parts of the same molecule separately). The list should be the same length as the trajectory, each list of AtomGroups representing a trajectory timestep.
         plot : boolean, optional
             If True the translational order parameter is plotted as a function of the spacing for the first time in the trajectory or specified in times.
+        start, stop, step : integer, optional
+            Only analyse the frames trajectory[start:stop:step], by default all frames. Frames outside are never read.
+        frames : list of integer, optional
+            Indices of the frames to analyse, instead of start, stop and step. times is applied on top of either.
+        unwrap : boolean, optional
+            Only used for pos_style "com". If True each molecule is made whole by taking the minimum image of its atoms relative to its first atom before the center of mass is calculated, by default False. Molecules need to be smaller than half the box.
         
         ToDo
         ----
@@ -197,62 +253,96 @@ class OrderParameterEnsemble(BaseUniverse):
 
         self.universe = self._get_universe(self._coord, traj=self._traj)
 
-        self.selected_species = self._select_species(self.universe,
-                                                            style=style)
-        self._custom_traj_check(times, custom_traj)
+        frame_indices = self._get_frame_indices(times=times, start=start, stop=stop, step=step, frames=frames)
+
+        self._prepare_translational_op(frame_indices, director, style=style, pos_style=pos_style, search_param=search_param, custom_traj=custom_traj, plot=plot, unwrap=unwrap)
+
+        # Loop over the selected frames, the others are never read
+        for frame_number, time in enumerate(self.universe.trajectory[frame_indices]):
+            self._translational_op_single_frame(time, frame_number)
+
+        self._conclude_translational_op()
+
+        # Rewind Trajectory to beginning for other analysis
+        self.universe.trajectory.rewind()
 
-        director = self._director_check(times, director)
+    def _prepare_translational_op(self, frame_indices, director, style="molecule", pos_style="com", search_param=[0.1, 50, 500], custom_traj=None, plot=False, unwrap=False):
+        """ Check the input of the translational order parameter analysis and initialise its outputs
+
+        Parameters
+        ----------
+        frame_indices : numpy array of int
+            Indices of the frames analysed
+        director, style, pos_style, search_param, custom_traj, plot, unwrap
+            See translational_op_analysis
+
+        Raises
+        ------ 
+        IndexError
+            If search_param is not of length 3
+        """
+        self.selected_species = self._select_species(self.universe, style=style)
+        self._custom_traj_check(frame_indices, custom_traj)
+
+        self._trans_director = self._director_check(frame_indices, director)
         
         # Set search_param if it is not specified by user. If it is specified check its length and make sure the minimum value is not zero.
         if search_param is None:
             search_param = [0.1, 50, 500]
         else:
+            search_param = list(search_param)
             if len(search_param) != 3:
-                IndexError("len(search_param) is not 3")
+                raise IndexError("len(search_param) is not 3")
             elif search_param[0] == 0:
                 search_param[0] += 0.01
 
-        spacing_array = np.linspace(*search_param)
+        self._spacing_array = np.linspace(*search_param)
+
+        self._trans_style = style
+        self._trans_pos_style = pos_style
+        self._trans_unwrap = unwrap
+        self._trans_custom_traj = custom_traj
+        self._trans_plot = plot
 
         # Initialise outputs
         self.trans_op_list = []
         self.trans_spacing_list = []
-        director_idx = 0
 
-        # Loop over all trajectory times
-        for time in self.universe.trajectory:
-            if times is not None:
-                if time.time > max(times) or time.time < min(times):
-                    continue
+    def _translational_op_single_frame(self, time, frame_number):
+        """ Optimise the translational order parameter and spacing of the current frame
 
-            position_array = self._get_position_array(style, pos_style,custom_traj)
-            
-            # Optimise the translational order parameter and determine the spacing
-            trans_op_k = []
-            spacing_list = []
-            for spacing in spacing_array:
-                k_vector = 2*np.pi/spacing * director[director_idx]
-                trans_op_k.append(np.sqrt(self._get_system_fourier_transform_mod2(position_array, k_vector, 1))/float(len(position_array)))
-            
-            idx_max = np.argmax(trans_op_k)
-            trans_op = trans_op_k[idx_max]
-            trans_spacing = spacing_array[idx_max]
-
-            print("****TIME: {:8.2f}".format(time.time))
-            print("Translational order parameter: {:.3f}".format(trans_op))
-            print("Translational spacing: {:.3f} Angstrom".format(trans_spacing))
-            
-            self.trans_op_list.append(trans_op)
-            self.trans_spacing_list.append(trans_spacing)
+        Parameters
+        ----------
+        time : MDAnalysis Timestep
+            Current frame
+        frame_number : integer
+            Position of the frame in the analysed frames
+        """
+        position_array = self._get_position_array(self._trans_style, self._trans_pos_style, self._trans_custom_traj, frame_number, unwrap=self._trans_unwrap)
+        
+        # Optimise the translational order parameter and determine the spacing, all spacings in one call
+        k_vectors = np.outer(2*np.pi/self._spacing_array, np.ravel(self._trans_director[frame_number]))
+        trans_op_k = np.sqrt(self._get_system_fourier_transform_mod2(position_array, k_vectors))/float(len(position_array))
+        
+        idx_max = np.argmax(trans_op_k)
+        trans_op = trans_op_k[idx_max]
+        trans_spacing = self._spacing_array[idx_max]
 
-            director_idx += 1
+        print("****TIME: {:8.2f}".format(time.time))
+        print("Translational order parameter: {:.3f}".format(trans_op))
+        print("Translational spacing: {:.3f} Angstrom".format(trans_spacing))
+        
+        self.trans_op_list.append(trans_op)
+        self.trans_spacing_list.append(trans_spacing)
 
-            if plot:
-                plt.plot(spacing_array,trans_op_k)
-                plt.show()
-                plot=False
+        if self._trans_plot:
+            plt.plot(self._spacing_array,trans_op_k)
+            plt.show()
+            self._trans_plot = False
 
-        # Calculate mean and standard deviations
+    def _conclude_translational_op(self):
+        """ Calculate the means and standard deviations of the translational order parameter analysis
+        """
         self.mean_trans_op = np.mean(self.trans_op_list)
         self.stdev_trans_op = np.std(self.trans_op_list)
         self.mean_trans_spacing = np.mean(self.trans_spacing_list)
@@ -262,10 +352,7 @@ class OrderParameterEnsemble(BaseUniverse):
         print("Mean translational order parameter: {:.3f} +/- {:.3f}".format(self.mean_trans_op,self.stdev_trans_op))
         print("Mean translational spacing: {:.3f} +/- {:.3f} Angstrom".format(self.mean_trans_spacing,self.stdev_trans_spacing))
 
-        # Rewind Trajectory to beginning for other analysis
-        self.universe.trajectory.rewind()
-
-    def structure_factor_analysis(self, directors=None, times=None, style="molecule", pbc_style=None, pos_style="com", q_style="strict", q_min=0, q_max=1, q_step = 0.01, active_dim=[1,1,1], custom_traj=None, chunk_size=10000, plot_style="scatter", n_bins = 1000):
+    def structure_factor_analysis(self, directors=None, times=None, style="molecule", pbc_style=None, pos_style="com", q_style="strict", q_min=0, q_max=1, q_step = 0.01, active_dim=[1,1,1], custom_traj=None, chunk_size=None, plot_style="scatter", n_bins = 1000, start=None, stop=None, step=None, frames=None, unwrap=False, method="direct", raw_output=None, n_threads=1, overwrite_raw_output=False):
         """High level function for calculating the structure factor as a function of the wave vector q.
         
         Example
@@ -285,7 +372,7 @@ class OrderParameterEnsemble(BaseUniverse):
             cluster_objects attribute is interpreted as molecule
             or atoms within a molecule. 
         pbc_style : string, optional
-            Gromacs pbc definitions: mol, atom, nojump
+            Gromacs pbc definitions: whole, mol, res, atom, nojump. Applied to every frame as it is read.
         pos_style : string, optional
             Center of mass ("com") or "atom"
         q_style : string, optional
@@ -301,17 +388,36 @@ class OrderParameterEnsemble(BaseUniverse):
         custom_traj : list of list of AtomGroup, optional
             To be specified if the analysis is to be applied to clusters or other custom AtomGroups (i.e. if you want to consider different parts of the same molecule separately). The list should be the same length as the trajectory, each list of AtomGroups representing a trajectory timestep.
         chunk_size : integer, optional
-            The array of wave vectors is split into chunks of this size for the square modulus of the fourier transform calculation. A high number means more ram usage, a lower number means lower ram usage. Overall it does not have a major impact on performance.
+            The array of wave vectors is split into chunks of this size for the square modulus of the fourier transform calculation. A high number means more ram usage, a lower number means lower ram usage. If None it is chosen so the intermediate array of a chunk takes about 4 MB, a fixed cache target (see _get_chunk_size) rather than a memory budget.
         plot_style : string, optional
             If None no plot is generated. Other options are "smooth" and "scatter".
         n_bins : integer, optional
-            In case of data smoothing, the number of bins used.
+            Number of bins between q_min and q_max the structure factor is averaged in, the averages are stored in smooth_q_norm, smooth_Sq and smooth_Sq_error.
+        start, stop, step : integer, optional
+            Only analyse the frames trajectory[start:stop:step], by default all frames. Frames outside are never read.
+        frames : list of integer, optional
+            Indices of the frames to analyse, instead of start, stop and step. times is applied on top of either.
+        unwrap : boolean, optional
+            Only used for pos_style "com". If True each molecule is made whole by taking the minimum image of its atoms relative to its first atom before the center of mass is calculated, by default False. Molecules need to be smaller than half the box.
+        method : string, optional
+            "direct" sums over all positions for every wave vector. "fft" spreads the positions onto a grid and uses a fast fourier transform, which is much faster for many wave vectors and positions but approximate (typically 1e-4 relative). "fft" is only available for q_style "strict" without directors. By default "direct".
+        raw_output : None, boolean or string, optional
+            If True the structure factor of every wave vector of every frame is kept in memory in q_array_all, q_norm_array and Sq_array, with the multiplicity of each wave vector in q_weight_array (only one of q and -q is calculated as S(q) = S(-q)). If a path is given they are written to that .npy file (a structured array with the fields q, q_norm, Sq and q_weight, see StructureFactorAccumulator) and memory mapped from it. If False only the binned averages are kept, so the memory does not grow with the number of frames. By default None, which keeps them in memory only if plot_style is "scatter".
+        n_threads : integer, optional
+            Number of threads the chunks of wave vectors are distributed over for method "direct", by default 1
+        overwrite_raw_output : boolean, optional
+            If raw_output is a path of an existing file it is only overwritten if this is True, by default False
 
         Raises
         ------ 
         NotImplementedError
             If unspecified q_style is supplied by user
             If plot_style is not "scatter" or "smooth"
+            If unspecified method is supplied by user or method "fft" is used without q_style "strict"
+        ValueError
+            If plot_style is "scatter" but raw_output is False
+        FileExistsError
+            If raw_output is an existing file and overwrite_raw_output is False
         
         ToDo
         ----
@@ -322,79 +428,159 @@ class OrderParameterEnsemble(BaseUniverse):
 
         self.universe = self._get_universe(self._coord, traj=self._traj)
 
-        self.selected_species = self._select_species(self.universe,
-                                                            style=style)
-        self._custom_traj_check(times, custom_traj)
+        frame_indices = self._get_frame_indices(times=times, start=start, stop=stop, step=step, frames=frames)
 
+        self._prepare_structure_factor(frame_indices, directors=directors, style=style, pos_style=pos_style, q_style=q_style, q_min=q_min, q_max=q_max, q_step=q_step, active_dim=active_dim, custom_traj=custom_traj, chunk_size=chunk_size, unwrap=unwrap, method=method, n_bins=n_bins, raw_output=raw_output, plot_style=plot_style, n_threads=n_threads, overwrite_raw_output=overwrite_raw_output)
+
+        # Loop over the selected frames, the others are never read
+        for frame_number, time in enumerate(self.universe.trajectory[frame_indices]):
+            self._structure_factor_single_frame(time, frame_number)
+
+        # Rewind Trajectory to beginning for other analysis
+        self.universe.trajectory.rewind()
+
+        self._conclude_structure_factor(plot_style=plot_style)
+
+    def _prepare_structure_factor(self, frame_indices, directors=None, style="molecule", pos_style="com", q_style="strict", q_min=0, q_max=1, q_step = 0.01, active_dim=[1,1,1], custom_traj=None, chunk_size=None, unwrap=False, method="direct", n_bins=1000, raw_output=None, plot_style="scatter", n_threads=1, overwrite_raw_output=False):
+        """ Check the input of the structure factor analysis and set up the wave vector generation
+
+        Parameters
+        ----------
+        frame_indices : numpy array of int
+            Indices of the frames analysed
+        directors, style, pos_style, q_style, q_min, q_max, q_step, active_dim, custom_traj, chunk_size, unwrap, method, n_bins, raw_output, plot_style, n_threads, overwrite_raw_output
+            See structure_factor_analysis
+
+        Raises
+        ------ 
+        NotImplementedError
+            If unspecified q_style is supplied by user
+            If unspecified method is supplied by user or method "fft" is used without q_style "strict"
+        ValueError
+            If plot_style is "scatter" but raw_output is False
+        FileExistsError
+            If raw_output is an existing file and overwrite_raw_output is False
+        """
+        self.selected_species = self._select_species(self.universe, style=style)
+        self._custom_traj_check(frame_indices, custom_traj)
+
+        if plot_style == "scatter" and raw_output is False:
+            raise ValueError("plot_style scatter needs the raw output, raw_output can not be False")
+        if raw_output is None:
+            raw_output = (plot_style == "scatter")
+
+        self._sf_directors_list = None
         if directors is not None:
-            # Check form of directors and initialise the director_idx variable
-            directors_list = self._director_check(times,directors)
-            directors_idx = 0
+            # Check form of directors
+            self._sf_directors_list = self._director_check(frame_indices,directors)
 
             print("****NOTE: As directors are specified, the wave vector q generation method defaults to grid and the active_dim list is not used")
             
             q_style = "grid"
 
-        if q_style is "strict":
+        if q_style == "strict":
             self.gen_q = self._gen_q_array_strict
             print("****NOTE: As q_style strict is selected, the variable q_step is not used")
-        elif q_style is "grid":
+        elif q_style == "grid":
             self.gen_q = self._gen_q_array_grid
         else:
             raise NotImplementedError("q_style {:s} is not implemented".format(q_style))
 
+        # The fft only gives the transform at the reciprocal lattice vectors of the box
+        if method == "direct":
+            self._sf_fourier_transform_mod2 = self._get_system_fourier_transform_mod2
+        elif method == "fft" and q_style == "strict":
+            self._sf_fourier_transform_mod2 = self._get_system_fourier_transform_mod2_fft
+        elif method == "fft":
+            raise NotImplementedError("method fft is only implemented for q_style strict without directors")
+        else:
+            raise NotImplementedError("method {:s} is not implemented".format(method))
+
         # generate q at each timestep flag
-        gen_q_flag = True
+        self._gen_q_flag = True
         # Note if type directors is a numpy array then the director is the same for all timesteps and the q_array can be generator in advance
         if type(directors) == np.ndarray:
             # Use first entry in directors_list as this have been converted into the right format of numpy array(1,3)
-            q_array = self.gen_q(directors_list[0], q_min, q_max, q_step)
-            q_norm = np.linalg.norm(q_array,axis=1)
-            gen_q_flag = False
+            self._sf_q_norm, self._sf_q_array, self._sf_q_weights = self.gen_q(self._sf_directors_list[0], q_min, q_max, q_step)
+            self._gen_q_flag = False
+
+        self._sf_style = style
+        self._sf_pos_style = pos_style
+        self._sf_unwrap = unwrap
+        self._sf_custom_traj = custom_traj
+        self._sf_active_dim = active_dim
+        self._sf_q_limits = (q_min, q_max, q_step)
+        self._sf_chunk_size = chunk_size
+        self._sf_n_threads = n_threads
+        # One thread pool for all frames, closed in _conclude_structure_factor
+        self._sf_pool = ThreadPool(n_threads) if n_threads > 1 else None
+
+        # Binned averages and the optional raw output, filled frame by frame
+        self._sf_accumulator = StructureFactorAccumulator(q_min, q_max, n_bins, raw=raw_output, overwrite=overwrite_raw_output)
+        self.q_array_all = None
+        self.q_norm_array = None
+        self.Sq_array = None
+        self.q_weight_array = None
+
+    def _structure_factor_single_frame(self, time, frame_number):
+        """ Calculate the structure factor of the current frame and append it to the outputs
 
-        # Flag used to initialise the output numpy arrays
-        initialise_flag = True
-        
-        # Loop over all trajectory times
-        for time in self.universe.trajectory:
-            if times is not None:
-                if time.time > max(times) or time.time < min(times):
-                    continue
-
-            # Check if q needs to be generated
-            if gen_q_flag:
-                if directors == None:
-                    timestep_directors = self._calc_directors(active_dim)
-                    
-                else:
-                    timestep_directors = directors_list[directors_idx]
-                    directors_idx += 1
-
-                q_norm, q_array = self.gen_q(timestep_directors, q_min, q_max, q_step)
-
-            position_array = self._get_position_array(style, pos_style, custom_traj)
-
-            Sq = self._get_system_fourier_transform_mod2(position_array,q_array,chunk_size)/len(position_array)
-
-            if initialise_flag:
-                self.q_array_all = q_array
-                self.q_norm_array = q_norm
-                self.Sq_array = Sq
-                initialise_flag = False
+        Parameters
+        ----------
+        time : MDAnalysis Timestep
+            Current frame
+        frame_number : integer
+            Position of the frame in the analysed frames
+        """
+        # Check if q needs to be generated
+        if self._gen_q_flag:
+            if self._sf_directors_list is None:
+                timestep_directors = self._calc_directors(self._sf_active_dim)
             else:
-                self.q_array_all = np.vstack((self.q_array_all,q_array))
-                self.q_norm_array = np.append(self.q_norm_array,q_norm)
-                self.Sq_array = np.append(self.Sq_array,Sq)
+                timestep_directors = self._sf_directors_list[frame_number]
 
-            print("****TIME: {:8.2f}".format(time.time))
+            self._sf_q_norm, self._sf_q_array, self._sf_q_weights = self._get_q_array(timestep_directors, *self._sf_q_limits)
+        q_norm = self._sf_q_norm
+        q_array = self._sf_q_array
 
-        # Rewind Trajectory to beginning for other analysis
-        self.universe.trajectory.rewind()
+        position_array = self._get_position_array(self._sf_style, self._sf_pos_style, self._sf_custom_traj, frame_number, unwrap=self._sf_unwrap)
+
+        Sq = self._sf_fourier_transform_mod2(position_array,q_array,self._sf_chunk_size,self._sf_n_threads,self._sf_pool)/len(position_array)
+
+        self._sf_accumulator.add(q_array, q_norm, Sq, self._sf_q_weights)
+
+        print("****TIME: {:8.2f}".format(time.time))
+
+    def _conclude_structure_factor(self, plot_style="scatter"):
+        """ Collect the binned averages and raw output of the structure factor and plot it
+
+        Parameters
+        ----------
+        plot_style
+            See structure_factor_analysis
+
+        Raises
+        ------ 
+        NotImplementedError
+            If plot_style is not "scatter" or "smooth"
+        """
+        if self._sf_pool is not None:
+            self._sf_pool.close()
+            self._sf_pool.join()
+            self._sf_pool = None
+
+        self._sf_accumulator.close()
+        if self._sf_accumulator.raw is not False:
+            self.q_array_all = self._sf_accumulator.q_array
+            self.q_norm_array = self._sf_accumulator.q_norm
+            self.Sq_array = self._sf_accumulator.Sq
+            self.q_weight_array = self._sf_accumulator.q_weights
+
+        self.smooth_q_norm, self.smooth_Sq = self._smooth_structure_factor()
+        self.smooth_Sq_error = self._sf_accumulator.get_error()
 
-        # Plot structure factor
         if plot_style is not None:
-            if plot_style is "smooth":
-                self.smooth_q_norm, self.smooth_Sq = self._smooth_structure_factor(q_min, q_max, n_bins)
+            if plot_style == "smooth":
                 plt.plot(self.smooth_q_norm,self.smooth_Sq)
                 #plt.scatter(self.q_norm_array,self.Sq_array)
                 plt.show()
@@ -402,107 +588,114 @@ class OrderParameterEnsemble(BaseUniverse):
                 plt.scatter(self.q_norm_array,self.Sq_array)
                 plt.show()
             else:
-                NotImplementedError("plot_style {:s} has not been implemented".format(plot_style))
+                raise NotImplementedError("plot_style {:s} has not been implemented".format(plot_style))
 
-    def _custom_traj_check(self, times, custom_traj):
-        """ Check if custom_traj is the correct length relative to the trajectory and times specified. And initialise variable self.custom_traj_idx
+    def _custom_traj_check(self, frame_indices, custom_traj):
+        """ Check if custom_traj is the correct length relative to the frames analysed.
         
         Parameters
         ----------
-        times : list of floats
-            If None, do for whole trajectory. If an interval
-            is given like this (t_start, t_end) only do from start
-            to end.
+        frame_indices : numpy array of int
+            Indices of the frames analysed
         custom_traj : list of list of AtomGroup
             To be specified if the analysis is to be applied to clusters or other custom AtomGroups (i.e. if you want to consider different parts of the same molecule separately). The list should be the same length as the trajectory, each list of AtomGroups representing a trajectory timestep.
 
         Raises
         ------ 
         IndexError
-            If list is different length from trajetory or times
+            If list is different length from the frames analysed
         """
         if custom_traj is not None:
-            status, n_timesteps = _custom_list_v_traj_check(self, times, custom_traj)
+            status, n_timesteps = self._custom_list_v_traj_check(frame_indices, custom_traj)
             if not status:
                 raise IndexError("custom_traj (len: {:d}) supplied is not the same length as the times in trajectory/times specified (len: {:d})".format(len(custom_traj),n_timesteps))
-            self.custom_traj_idx = 0
 
-    def _custom_list_v_traj_check(self, times, custom_list):
-        """ Check if a list is the correct size relative to the trajectory and times specified.
+    def _custom_list_v_traj_check(self, frame_indices, custom_list):
+        """ Check if a list is the correct size relative to the frames analysed.
 
-        times : list of floats
-            If None, do for whole trajectory. If an interval
-            is given like this (t_start, t_end) only do from start
-            to end.
+        frame_indices : numpy array of int
+            Indices of the frames analysed
         custom_list : list 
 
         """
-        if times is not None:
-            n_timesteps = int((max(times)-min(times))/self.universe.trajectory.dt+1)
-            if len(custom_list) != n_timesteps:
-                return False, n_timesteps
-            return True, n_timesteps
-        else:
-            n_timesteps = len(self.universe.trajectory)
-            if len(custom_list) != n_timesteps:
-                return False, n_timesteps
-            return True, n_timesteps
+        n_timesteps = len(frame_indices)
+        if len(custom_list) != n_timesteps:
+            return False, n_timesteps
+        return True, n_timesteps
+
+    def _get_inertial_axis(self, atom_indices, offsets):
+        """ Get principal molecular axes based on the intertia tensor, for all groups of atoms at once
 
-    def _get_inertial_axis(self, atom_group_list):
-        """ Get list of principal molecular axis based on the intertia tensor
+        The inertia tensors of all groups are built with segment sums over the flat atom index array and diagonalised together with a single call of np.linalg.eigh. The principal axis is the eigenvector of the smallest eigenvalue, the same as atom_group.principal_axes()[2] up to its sign.
         
         Parameters
         ----------
-        atom_group_list : list of AtomGroups
+        atom_indices : numpy array(n_atoms) of int
+            Indices of the atoms of all groups, one group after the other
+        offsets : numpy array(n_groups+1) of int
+            Start of each group in atom_indices and the total number of atoms
         
         Returns
         -------
-        principal_axis_list : list of numpy array(3)
-            list of numpy array(3) of the principal axis vector
+        principal_axis_list : numpy array(n_groups,3)
+            Principal axis vector of each group
         """
-        principal_axis_list = []
-        for atom_group in atom_group_list:
-            principal_axis_list.append(atom_group.principal_axes()[2])
-        
-        return principal_axis_list
+        masses, group_masses, group_ids = self._get_group_masses(atom_indices, offsets)
+        positions = self.universe.atoms.positions[atom_indices].astype(np.float64)
+
+        center_of_mass = self._segment_sum(masses[:,np.newaxis]*positions, offsets)/group_masses[:,np.newaxis]
+        relative_positions = positions - center_of_mass[group_ids]
+
+        # Mass weighted second moments sum(m r_i r_j) of each group
+        second_moments = self._segment_sum(masses[:,np.newaxis,np.newaxis]*relative_positions[:,:,np.newaxis]*relative_positions[:,np.newaxis,:], offsets)
+
+        inertia_tensors = np.trace(second_moments, axis1=1, axis2=2)[:,np.newaxis,np.newaxis]*np.identity(3) - second_moments
+
+        # Eigenvalues are in ascending order, the first one belongs to the long axis
+        _, eig_vecs = np.linalg.eigh(inertia_tensors)
 
-    def _get_end_to_end_vector(self, atom_group_list):
-        """ Get the end-to-end vector of atom group. Note it finds the vector between the first and last atom.
+        return eig_vecs[:,:,0]
+
+    def _get_end_to_end_vector(self, atom_indices, offsets):
+        """ Get the end-to-end vectors of all groups of atoms at once. Note it finds the unit vector from the first to the last atom of each group.
         
         Parameters
         ----------
-        atom_group_list : list of AtomGroups
+        atom_indices : numpy array(n_atoms) of int
+            Indices of the atoms of all groups, one group after the other
+        offsets : numpy array(n_groups+1) of int
+            Start of each group in atom_indices and the total number of atoms
         
         Returns
         -------
-        end_to_end_list : list of numpy array(3)
-            list of numpy arrays of the principal axis vector
+        end_to_end_list : numpy array(n_groups,3)
+            Normalised end-to-end vector of each group
         """
-        end_to_end_list = []
-        for atom_group in atom_group_list:
-            end_to_end_list.append(atom_group[0]-atom_group[-1])
+        positions = self.universe.atoms.positions
+        first_atoms = atom_indices[offsets[:-1]]
+        last_atoms = atom_indices[offsets[1:] - 1]
+        end_to_end_list = positions[last_atoms].astype(np.float64) - positions[first_atoms]
 
-        return end_to_end_list
+        return end_to_end_list/np.linalg.norm(end_to_end_list, axis=1)[:,np.newaxis]
 
     def _get_saupe_tensor(self, principal_axis_list):
         """ Calculate saupe tensor from principal axes
         
         Parameters
         ----------
-        principal_axis_list : list of numpy array(3)
-            list of numpy arrays of the principal axis vector
+        principal_axis_list : numpy array(n,3) or list of numpy array(3)
+            Unit vectors of the principal axes
         
         Returns
         -------
-        saupe_tensor : numpy array(3,3arr)
+        saupe_tensor : numpy array(3,3)
         """
-        saupe_tensor = np.zeros((3,3))
-        half_identity_matrix = np.identity(3)/2.0
-        for axis in principal_axis_list:
-            saupe_tensor += 1.5 * np.outer(axis,axis) - half_identity_matrix
-        saupe_tensor /= len(principal_axis_list)
+        principal_axis_array = np.asarray(principal_axis_list, dtype=np.float64)
+
+        # Mean of the outer products of all axes
+        mean_outer = np.einsum("ni,nj->ij", principal_axis_array, principal_axis_array)/len(principal_axis_array)
 
-        return saupe_tensor
+        return 1.5 * mean_outer - np.identity(3)/2.0
 
     def _get_dominant_eig(self, matrix):
         """ Calculate dominant eigen value and vector
@@ -527,22 +720,20 @@ class OrderParameterEnsemble(BaseUniverse):
 
         return eig_val1, eig_vec1
 
-    def _director_check(self, times, director):
+    def _director_check(self, frame_indices, director):
         """ Check if director is the correct length and form. If it is a numpy array convert it into a list of correct length relative to times and trajectory. If it is a list check size relative to the trajectory and times specified. If the dimension of the director numpy array is 1, convert it into a numpy array(1,3).
         
         Parameters
         ----------
-        times : list of floats
-            If None, do for whole trajectory. If an interval
-            is given like this (t_start, t_end) only do from start
-            to end.
+        frame_indices : numpy array of int
+            Indices of the frames analysed
         director : numpy array(3) or numpy array(=<3,3) or list of numpy array(=<3,3) or list of numpy array(3)
 
         Raises
         ------ 
         IndexError
             If numpy arrays in director are not (=<3,3)
-            If list is different length from trajetory or times
+            If list is different length from the frames analysed
         TypeError
             If specified director is not a numpy array or list of numpy arrays
         """
@@ -552,10 +743,7 @@ class OrderParameterEnsemble(BaseUniverse):
 
             # Check if director has 3 columns and not more than 3 rows
             if np.size(director,axis=1) == 3 and np.size(director,axis=0) < 3.5:
-                if times is None:
-                    n_timesteps = len(self.universe.trajectory)
-                else:
-                    n_timesteps = int((max(times)-min(times))/self.universe.trajectory.dt+1)
+                n_timesteps = len(frame_indices)
                 # Convert director into list of numpy arrays (one for each timestep)
                 director = [director for idx in range(n_timesteps)]
             else:
@@ -563,7 +751,7 @@ class OrderParameterEnsemble(BaseUniverse):
         
         elif type(director) is list and all([type(director_i) is np.ndarray for director_i in director]):
 
-            status, n_timesteps = self._custom_list_v_traj_check(times, director)
+            status, n_timesteps = self._custom_list_v_traj_check(frame_indices, director)
             if not status:
                 raise IndexError("director (len: {:d}) supplied is not the same length as the times in trajectory/times specified (len: {:d})".format(len(director),n_timesteps))
 
@@ -595,8 +783,8 @@ class OrderParameterEnsemble(BaseUniverse):
             raise IndexError("director (ndim: {:d}) more than 2 dimensionss".format(director.ndim))
         return director
 
-    def _get_position_array(self, style, pos_style, custom_traj):
-        """  Get positions array for custom_traj or selected_species as either the positions of the atoms or the centers of mass of the provided AtomGroups.
+    def _get_position_array(self, style, pos_style, custom_traj, frame_number=0, unwrap=False):
+        """  Get positions array for custom_traj or the selected species as either the positions of the atoms or the centers of mass of the provided AtomGroups.
 
         Parameters
         ----------
@@ -608,6 +796,10 @@ class OrderParameterEnsemble(BaseUniverse):
             Center of mass ("com") or "atom"
         custom_traj : list of list of AtomGroup
             To be specified if the analysis is to be applied to clusters or other custom AtomGroups (i.e. if you want to consider different parts of the same molecule separately). The list should be the same length as the trajectory, each list of AtomGroups representing a trajectory timestep.
+        frame_number : integer, optional
+            Position of the current frame in the analysed frames, used to index custom_traj
+        unwrap : boolean, optional
+            Make the groups whole before their center of mass is calculated
 
         Returns
         -------
@@ -619,50 +811,83 @@ class OrderParameterEnsemble(BaseUniverse):
             NotImplementedError
                 If unspecified pos_style is given
         """
-        if pos_style is "com":
-            if custom_traj is not None:
-                atom_group_list = custom_traj[self.custom_traj_idx]
-                self.custom_traj_idx += 1
-            else:
-                atom_group_list = [self._select_species(residue.atoms, style=style) for residue in self.selected_species.residues]
-            position_array = self._get_center_of_mass(atom_group_list)
-        elif pos_style is "atom":
-            if custom_traj is not None:
-                position_array = custom_traj[self.custom_traj_idx][0].positions
-                for atom_group in custom_traj[self.custom_traj_idx][1:]:
-                    position_array = np.vstack(atom_group.positions)
-                self.custom_traj_idx += 1
-            else:
-                position_array = self.selected_species.positions
+        if custom_traj is not None:
+            atom_indices, offsets = self._get_group_indices(custom_traj[frame_number])
+        else:
+            atom_indices, offsets = self._compile_species(style)
+
+        if pos_style == "com":
+            position_array = self._get_center_of_mass(atom_indices, offsets, unwrap=unwrap)
+        elif pos_style == "atom":
+            position_array = self.universe.atoms.positions[atom_indices]
         else:
             raise NotImplementedError("{:s} is unspecified style".format(pos_style))
         return position_array
 
-    def _get_center_of_mass(self, atom_group_list):
-        """ Get list of the center of mass
+    def _get_center_of_mass(self, atom_indices, offsets, unwrap=False):
+        """ Get the centers of mass of all groups of atoms at once with segment sums
         
         Parameters
         ----------
-        atom_group_list : list of AtomGroups
+        atom_indices : numpy array(n_atoms) of int
+            Indices of the atoms of all groups, one group after the other
+        offsets : numpy array(n_groups+1) of int
+            Start of each group in atom_indices and the total number of atoms
+        unwrap : boolean, optional
+            If True the minimum image of every atom relative to the first atom of its group is used, so groups split by the periodic boundaries are made whole first, by default False
         
         Returns
         -------
-        center_of_mass_list : list of numpy array(3)
-            list of numpy arrays of the center of mass of each AtomGroup
+        position_array : numpy array(n_groups,3)
+            Center of mass of each group
         """
-        center_of_mass_list = []
-        for atom_group in atom_group_list:
-            center_of_mass_list.append(atom_group.center_of_mass())
-        position_array = np.asarray(center_of_mass_list)
+        masses, group_masses, group_ids = self._get_group_masses(atom_indices, offsets)
+        positions = self.universe.atoms.positions[atom_indices].astype(np.float64)
+
+        if unwrap:
+            box_vectors = mdamath.triclinic_vectors(self.universe.dimensions)
+            first_positions = positions[offsets[:-1]][group_ids]
+            fractional = np.matmul(positions - first_positions, np.linalg.inv(box_vectors))
+            fractional -= np.round(fractional)
+            positions = first_positions + np.matmul(fractional, box_vectors)
+
+        position_array = self._segment_sum(masses[:,np.newaxis]*positions, offsets)/group_masses[:,np.newaxis]
         return position_array
 
-    def _get_system_fourier_transform_mod2(self, positions, k_vectors, chunk_size):
+    def _get_group_masses(self, atom_indices, offsets):
+        """ Get the masses of the atoms and groups of a CSR layout. They are kept for the last atom_indices used, so they are only looked up once for index arrays used every frame.
+
+        Parameters
+        ----------
+        atom_indices : numpy array(n_atoms) of int
+        offsets : numpy array(n_groups+1) of int
+
+        Returns
+        -------
+        masses : numpy array(n_atoms)
+            Mass of each atom
+        group_masses : numpy array(n_groups)
+            Total mass of each group
+        group_ids : numpy array(n_atoms) of int
+            Group of each atom
+        """
+        if self._mass_indices is not atom_indices:
+            masses = self.universe.atoms.masses[atom_indices]
+            group_sizes = np.diff(offsets)
+
+            self._mass_indices = atom_indices
+            self._group_masses = (masses, self._segment_sum(masses, offsets), np.repeat(np.arange(len(group_sizes)), group_sizes))
+
+        return self._group_masses
+
+    def _get_system_fourier_transform_mod2(self, positions, k_vectors, chunk_size=None, n_threads=1, pool=None):
         """ Get the square modulus of the system fourier transform at specfied k_vector
 
         Note
         ----
         scipy.linalg.blas reduces computation time by 25% relative to numpy.matmul
         Chunking does not seem to negatively impact computation time, but reduces ram usage significantly
+        sgemm, cos and sin release the GIL, so the chunks run in parallel in a thread pool and every chunk writes its part of the preallocated output
         
         Parameters
         ----------
@@ -670,59 +895,193 @@ class OrderParameterEnsemble(BaseUniverse):
             numpy array of system positions
         k_vectors : numpy array(m,3)
             k-space vectors
-        chunk_size : integer
-            size of chunks
+        chunk_size : integer, optional
+            size of chunks, if None see _get_chunk_size
+        n_threads : integer, optional
+            Number of threads, by default 1
+        pool : multiprocessing.pool.ThreadPool, optional
+            Pool of n_threads threads reused across calls, if None and n_threads > 1 a pool is created for this call only
         
         Returns
         -------
-        mod2_fourier_transform : float (if m=1) or numpy array(m)
+        mod2_fourier_transform : numpy array(m)
             The square modulus of the fourier transform at the specified value of the k_vectors
         """
         # Convert array into fortran form (neccesary for scipy.linalg.blas)
-        positions = np.array(positions, order='F')
+        positions = np.array(positions, dtype=np.float32, order='F')
+        k_vectorsT = np.array(np.transpose(k_vectors), dtype=np.float32, order='F')
 
-        # If only one k_vector do not chunk select sgemv, otherwise use sgemm
-        if np.size(k_vectors,axis=0) == 1:
-            k_vectorsT = np.array(k_vectors, order='F')
-            blas_algorithm = scipy.linalg.blas.sgemv
-        else:
-            k_vectorsT = np.array(k_vectors.T, order='F')
-            blas_algorithm = scipy.linalg.blas.sgemm
+        n_k_vectors = np.size(k_vectorsT, axis=1)
+        if chunk_size is None:
+            chunk_size = self._get_chunk_size(len(positions), n_k_vectors, n_threads)
+
+        mod2_fourier_transform = np.empty(n_k_vectors, dtype=np.float32)
+
+        def transform_chunk(start):
+            pos_dot_k = scipy.linalg.blas.sgemm(1.0, positions, k_vectorsT[:,start:start+chunk_size])
+            sum_cos = np.square(np.sum(np.cos(pos_dot_k),axis=0))
+            sum_sin = np.square(np.sum(np.sin(pos_dot_k),axis=0))
+            mod2_fourier_transform[start:start+chunk_size] = sum_cos + sum_sin
 
-        if chunk_size == 1:
-            k_vectorsT_chunks = k_vectorsT
+        # Loop over chunks of wave vectors
+        chunk_starts = range(0, n_k_vectors, chunk_size)
+        if n_threads == 1:
+            for start in chunk_starts:
+                transform_chunk(start)
+        elif pool is not None:
+            pool.map(transform_chunk, chunk_starts)
         else:
-            # Find number of chunks and get list of chunks
-            len_k_vectorsT = np.size(k_vectorsT, axis=1)
-            n_chunks = max(1,int(len_k_vectorsT/chunk_size))
-            
-            k_vectorsT_remainder = k_vectorsT[:,(n_chunks*chunk_size):]
+            with ThreadPool(n_threads) as pool:
+                pool.map(transform_chunk, chunk_starts)
 
-            k_vectorsT = k_vectorsT[:,0:(n_chunks*chunk_size)]
+        return mod2_fourier_transform
 
-            k_vectorsT_chunks = np.split(k_vectorsT, n_chunks, axis=1)
+    def _get_chunk_size(self, n_positions, n_k_vectors, n_threads=1, chunk_bytes=2**22):
+        """ Get the number of wave vectors per chunk, so the float32 array of positions times wave vectors of one chunk takes about chunk_bytes and every thread gets at least one chunk
 
-            if k_vectorsT_remainder.size > 0.5:
-                k_vectorsT_chunks.append(k_vectorsT_remainder)
+        Note
+        ----
+        chunk_bytes is a fixed target that keeps the intermediate arrays close to the cache (4 MB chunks were fastest in a scan from 4 MB to 1 GB), not a memory budget. Every thread holds about three arrays of this size (positions times wave vectors, cos and sin), so the peak memory is about 3*n_threads*chunk_bytes.
 
-        # Loop over chunks of wave vectors
-        for idx, k_vectorsT_i in enumerate(k_vectorsT_chunks):
-            pos_dot_k = blas_algorithm(1.0, positions,k_vectorsT_i)
-            sum_cos = np.square(np.sum(np.cos(pos_dot_k),axis=0))
-            sum_sin = np.square(np.sum(np.sin(pos_dot_k),axis=0))
-            if idx == 0:
-                mod2_fourier_transform = (sum_cos + sum_sin)
-            else:
-                mod2_fourier_transform = np.append(mod2_fourier_transform, (sum_cos + sum_sin))
+        Parameters
+        ----------
+        n_positions : integer
+        n_k_vectors : integer
+        n_threads : integer, optional
+        chunk_bytes : integer, optional
+            Size of the intermediate array of a chunk, by default 4 MB
+
+        Returns
+        -------
+        chunk_size : integer
+        """
+        chunk_size = max(1, chunk_bytes // (4*max(1, n_positions)))
+        chunk_size = min(chunk_size, max(1, -(-n_k_vectors // n_threads)))
+
+        return chunk_size
+
+    def _get_system_fourier_transform_mod2_fft(self, positions, k_vectors, *args, order=6):
+        """ Get the square modulus of the system fourier transform at reciprocal lattice vectors with a particle mesh fast fourier transform
+
+        Note
+        ----
+        The positions are spread onto a grid in fractional coordinates with cardinal B-splines of the given order and the B-spline factors are divided out of the transform again (as in smooth particle mesh Ewald). The grid has at least twice as many points as needed for the largest Miller index in each dimension to keep the aliasing small. This costs O(n + G log G) instead of O(n m) for the direct sum, but is only exact up to the interpolation error (typically 1e-4 relative for order 6). *args is added so that it can accept chunk_size as an argument although it is not used.
+
+        Parameters
+        ----------
+        positions : numpy array(n,3)
+            numpy array of system positions
+        k_vectors : numpy array(m,3)
+            k-space vectors, integer combinations of the reciprocal lattice vectors of the current box
+        order : integer, optional
+            Order of the B-spline assignment, 2 is cloud in cell, by default 6
+
+        Returns
+        -------
+        mod2_fourier_transform : numpy array(m)
+            The square modulus of the fourier transform at the specified value of the k_vectors
+        """
+        box_vectors = mdamath.triclinic_vectors(self.universe.dimensions).astype(np.float64)
+
+        # Miller indices of the wave vectors, a_j . q = 2 pi n_j
+        miller_indices = np.rint(np.matmul(k_vectors, box_vectors.T)/(2.0*np.pi)).astype(int)
+        grid_shape = [scipy.fft.next_fast_len(max(4*n_max + 2, order)) for n_max in np.abs(miller_indices).max(axis=0)]
+        grid_shape = np.array(grid_shape)
+
+        # Fractional grid coordinates, the transform is periodic so the positions can be wrapped
+        grid_positions = np.matmul(np.asarray(positions, dtype=np.float64), np.linalg.inv(box_vectors))
+        grid_positions = (grid_positions - np.floor(grid_positions))*grid_shape
+        base = np.floor(grid_positions).astype(int)
+        weights = self._get_bspline_weights(grid_positions - base, order)
+
+        # Spread every position onto order**3 grid points, grid point base - j gets weight M(w + j)
+        grid_points = np.mod(base[:,np.newaxis,:] - np.arange(order)[np.newaxis,:,np.newaxis], grid_shape)
+        strides = np.array([grid_shape[1]*grid_shape[2], grid_shape[2], 1])
+        grid_points *= strides
+
+        # One plane of the stencil at a time, so only arrays of size n*order are needed
+        grid = np.zeros(np.prod(grid_shape))
+        for i in range(order):
+            for j in range(order):
+                flat_points = (grid_points[:,i,0] + grid_points[:,j,1])[:,np.newaxis] + grid_points[:,:,2]
+                point_weights = (weights[:,i,0]*weights[:,j,1])[:,np.newaxis]*weights[:,:,2]
+                grid += np.bincount(flat_points.ravel(), weights=point_weights.ravel(), minlength=len(grid))
+        grid = grid.reshape(grid_shape)
+
+        transform = np.fft.fftn(grid)
+        grid_indices = np.mod(miller_indices, grid_shape)
+        mod2_fourier_transform = np.square(np.abs(transform[grid_indices[:,0], grid_indices[:,1], grid_indices[:,2]]))
+
+        # Deconvolution with the modulus of the B-spline factors of each dimension
+        spline_values = self._get_bspline_weights(np.zeros((1,1)), order)[0,1:,0]
+        for dim in range(3):
+            phase = np.exp(2.0j*np.pi*np.outer(miller_indices[:,dim], np.arange(order - 1))/grid_shape[dim])
+            mod2_fourier_transform /= np.square(np.abs(np.matmul(phase, spline_values)))
 
         return mod2_fourier_transform
 
+    def _get_bspline_weights(self, fractions, order):
+        """ Get the cardinal B-spline weights M(w + j), j = 0, ..., order-1 of fractional grid offsets w
+
+        Parameters
+        ----------
+        fractions : numpy array(n,3)
+            Offsets w in [0,1) of positions from the grid point below
+        order : integer
+
+        Returns
+        -------
+        weights : numpy array(n,order,3)
+        """
+        # M_2(w) = w and M_2(w + 1) = 1 - w, higher orders by recursion
+        weights = np.zeros((len(fractions), order, 3))
+        weights[:,0] = fractions
+        weights[:,1] = 1.0 - fractions
+        for n in range(3, order + 1):
+            x = fractions[:,np.newaxis,:] + np.arange(n)[np.newaxis,:,np.newaxis]
+            shifted = np.concatenate((np.zeros((len(fractions),1,3)), weights[:,:n-1]), axis=1)
+            weights[:,:n] = (x*weights[:,:n] + (n - x)*shifted)/(n - 1)
+
+        return weights
+
+    def _get_q_array(self, directors, q_min, q_max, q_step):
+        """ Get the wave vectors of gen_q from a least recently used cache, so they are only generated again if the directors or limits change (e.g. not at all for a constant box)
+
+        Parameters
+        ----------
+        directors : numpy array(=<3,3)
+        q_min, q_max, q_step : float
+            See structure_factor_analysis
+
+        Returns
+        -------
+        q_norm : numpy array(n)
+            All the moduli of q
+        q_array : numpy array(n,3)
+            All the vectors of q, shared between calls with the same key and not to be modified
+        q_weights : numpy array(n) of int
+            Multiplicity of each q, see gen_q
+        """
+        directors = np.asarray(directors, dtype=np.float64)
+        key = (self.gen_q.__name__, directors.shape, np.round(directors, 10).tobytes(), q_min, q_max, q_step)
+
+        if key in self._q_cache:
+            self._q_cache.move_to_end(key)
+        else:
+            self._q_cache[key] = self.gen_q(directors, q_min, q_max, q_step)
+            if len(self._q_cache) > self._q_cache_size:
+                self._q_cache.popitem(last=False)
+
+        return self._q_cache[key]
+
     def _gen_q_array_strict(self, directors, q_min, q_max, *args):
         """ Generate wave vector (q) array strictly as integer combinations of the directors, which should correspond to the reciprocal lattice vectors
         
         Note
         ----
         *args is added so that it can accept q_step as an argument although it is not used, but this avoids additional if statements when looping over the trajectory.
+        The integer combinations are kept while the box fluctuates (e.g. NPT), only the vectors are scaled with the new directors.
+        As S(q) = S(-q) for real positions only one of q and -q is generated, with a weight of 2.
 
         Parameters
         ----------
@@ -738,23 +1097,16 @@ class OrderParameterEnsemble(BaseUniverse):
             All the moduli of q
         q_array : numpy array(n,3)
             All the vectors of q
+        q_weights : numpy array(n) of int
+            Multiplicity of each q
         """
-        # periodic_len = 2*pi / (distance between opposite simulation box faces)
-        periodic_len = np.linalg.norm(directors,axis=0)
+        # n = q pinv(directors), so |n_i| <= q_max times the norm of column i of pinv(directors)
+        periodic_len = 1.0 / np.linalg.norm(np.linalg.pinv(directors), axis=0)
 
         # Get maximum integer index
         n_max_vec = (q_max / periodic_len).astype(int)
-        n_min_vec = (q_min / periodic_len).astype(int)
 
-        # Generate combinations of the integer values
-        n_range = []
-        for n_max, n_min in zip(n_max_vec,n_min_vec):
-            if n_min == 0:
-                n_range.append(np.arange(-n_max, n_max+1, 1))
-            else:
-                n_range.append(np.append(np.arange(-n_max, n_min+1, 1),np.arange(n_min, n_max+1, 1)))
-
-        n_array = np.asarray([p for p in itertools.product(*[range_i for range_i in n_range])])
+        n_array, q_weights = self._get_miller_indices(n_max_vec)
 
         # Get all linear combinations of directors
         q_array = np.matmul(n_array,directors)
@@ -762,12 +1114,38 @@ class OrderParameterEnsemble(BaseUniverse):
         q_norm = np.linalg.norm(q_array,axis=1)
 
         # Remove values that violate the limits
-        q_norm, q_array = self._check_lim_q_array(q_norm, q_array, q_min, q_max)
+        q_norm, q_array, q_weights = self._check_lim_q_array(q_norm, q_array, q_weights, q_min, q_max)
+
+        return q_norm, q_array, q_weights
+
+    def _get_miller_indices(self, n_max_vec):
+        """ Get the integer combinations with -n_max <= n <= n_max in every dimension of one half-space, i.e. of every pair n and -n only the lexicographically positive one and not 0. The last combinations are kept, so they are only enumerated again if n_max changes.
+
+        Parameters
+        ----------
+        n_max_vec : numpy array(=<3) of int
+
+        Returns
+        -------
+        n_array : numpy array(n,=<3) of int
+        n_weights : numpy array(n) of int
+            Multiplicity of each combination, 2 for n and -n
+        """
+        n_max_vec = tuple(int(n_max) for n_max in n_max_vec)
+
+        if self._miller_n_max != n_max_vec:
+            n_ranges = [np.arange(-n_max, n_max+1) for n_max in n_max_vec]
+            n_array = np.stack([n_i.ravel() for n_i in np.meshgrid(*n_ranges, indexing="ij")], axis=1)
 
-        return q_norm, q_array
+            # The ranges are symmetric, so -n of the row i is the row len-1-i and 0 is the middle row
+            n_array = n_array[(len(n_array)+1)//2:]
+            self._miller_indices = (n_array, np.full(len(n_array), 2))
+            self._miller_n_max = n_max_vec
 
-    def _check_lim_q_array(self, q_norm, q_array, q_min, q_max):
-        """ Check if q_norm is within limits and remove values that violate the limits from q_norm and q_array
+        return self._miller_indices
+
+    def _check_lim_q_array(self, q_norm, q_array, q_weights, q_min, q_max):
+        """ Check if q_norm is within limits and remove values that violate the limits from q_norm, q_array and q_weights
 
         Parameters
         ----------
@@ -775,6 +1153,8 @@ class OrderParameterEnsemble(BaseUniverse):
             All the moduli of q
         q_array : numpy array(n,3)
             All the vectors of q
+        q_weights : numpy array(n) of int
+            Multiplicity of each q
         q_min : float
             minimum modulus of q
         q_max : float
@@ -786,23 +1166,15 @@ class OrderParameterEnsemble(BaseUniverse):
             All the moduli of q
         q_array : numpy array(m,3)
             All the vectors of q
+        q_weights : numpy array(m) of int
+            Multiplicity of each q
 
         """
         q_min = max(1e-5, q_min)
 
-        check_q_max = (q_norm > q_max)
-        check_q_min = (q_norm < q_min)
-
-        # Get indices of values in q_norm that violate the limits
-        del_idx_max = [i for i, x in enumerate(check_q_max) if x]
-        del_idx_min = [i for i, x in enumerate(check_q_min) if x]
-
-        del_idx = np.append(del_idx_max,del_idx_min)
+        within_limits = (q_norm >= q_min) & (q_norm <= q_max)
 
-        q_array = np.delete(q_array,del_idx,axis=0)
-        q_norm = np.delete(q_norm,del_idx)
-
-        return q_norm, q_array
+        return q_norm[within_limits], q_array[within_limits], q_weights[within_limits]
 
     def _gen_q_array_grid(self, directors, q_min, q_max, q_step):
         """ Generate wave vector (q) array in a grid as linear combinations of the directors
@@ -822,19 +1194,18 @@ class OrderParameterEnsemble(BaseUniverse):
         q_norm : numpy array(n)
             All the moduli of q
         q_array : numpy array(n,3)
-            All the vectors of q
+            All the vectors of q, only one of q and -q
+        q_weights : numpy array(n) of int
+            Multiplicity of each q
         """
-        # Generate q_range from q_max to q_min in steps of q_step (both for positive and negative integers)
-        if q_min == 0:
-            q_range = np.arange(-q_max,-q_max+q_step,q_step)
-        else:
-            q_range = np.append(np.arange(-q_max,-q_min+q_step,q_step),np.arange(q_min,q_max+q_step,q_step))
+        # Multiples of q_step from -q_max to q_max in each direction, q_min is checked on the modulus
+        n_max = int(np.floor(q_max/q_step + 1e-9))
 
         # Convert directors to unit vectors
-        for idx, director in enumerate(directors):
-            directors[idx,:] = director/np.linalg.norm(director)
+        directors = directors/np.linalg.norm(directors, axis=1)[:,np.newaxis]
 
-        q_range_comb = np.asarray([p for p in itertools.product(q_range,repeat=np.size(directors,axis=0))])
+        n_array, q_weights = self._get_miller_indices([n_max]*np.size(directors,axis=0))
+        q_range_comb = n_array*q_step
 
         # Get linear combination of q_range and directors
         q_array = np.matmul(q_range_comb,directors)
@@ -842,9 +1213,9 @@ class OrderParameterEnsemble(BaseUniverse):
         q_norm = np.linalg.norm(q_array,axis=1)
 
         # Remove values that violate limits
-        q_norm, q_array = self._check_lim_q_array(q_norm, q_array, q_min, q_max)
+        q_norm, q_array, q_weights = self._check_lim_q_array(q_norm, q_array, q_weights, q_min, q_max)
         
-        return q_norm, q_array
+        return q_norm, q_array, q_weights
     
     def _calc_directors(self, active_dim):
         """Calculate directors as the reciprocal lattice vectors. For orthorombic and triclinic simulation boxes the reciprocal lattice vectors are vector perpendicular to each face.
@@ -892,14 +1263,8 @@ class OrderParameterEnsemble(BaseUniverse):
                                    2.0*np.pi*v1xv2/np.dot(edge_vectors[2],v1xv2)])
         return recip_lat_vecs
 
-    def _smooth_structure_factor(self, q_min, q_max, n_bins):
-        """ Smooth structure factor
-
-        Parameters
-        ----------
-        q_min : float
-        q_max : float
-        n_bins : integer
+    def _smooth_structure_factor(self):
+        """ Smooth structure factor as the mean of the bins accumulated during the analysis, empty bins are 0
 
         Returns
         -------
@@ -907,23 +1272,5 @@ class OrderParameterEnsemble(BaseUniverse):
         smooth_q : numpy array(n_bins)
 
         """
-        norm_q = np.linspace(q_min, q_max, n_bins+1)
-        norm_q_step = (norm_q[1]-norm_q[0])/2.0
-        norm_q = norm_q[0:-1] + norm_q_step
-
-        norm_q_count = np.zeros((n_bins))
-        smooth_Sq = np.zeros((n_bins))
-
-        bin_number = (self.q_norm_array*n_bins/(q_max-q_min)).astype(int)
-
-        for idx, Sq in zip(bin_number,self.Sq_array):
-            norm_q_count[idx] += 1
-            smooth_Sq[idx] += Sq
-
-        # Adjust empty bins by adding one to avoid divide by zero errors
-        norm_q_count_add = (norm_q_count == 0).astype(int)
-
-        norm_q_count = norm_q_count + norm_q_count_add
-
-        smooth_Sq = smooth_Sq / norm_q_count
+        norm_q, smooth_Sq = self._sf_accumulator.get_mean()
         return norm_q, smooth_Sq
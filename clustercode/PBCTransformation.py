@@ -0,0 +1,214 @@
+import numpy as np
+import scipy.sparse
+import MDAnalysis.lib.mdamath as mdamath
+
+
+class PBCTransformation():
+    """On-the-fly periodic boundary treatment of a trajectory
+
+    Replaces converting the trajectory with gmx trjconv -pbc. The
+    transformation is added to the trajectory of a universe and applied
+    to every frame as it is read, so no new trajectory file is written.
+
+    Molecules are made whole along a breadth-first spanning tree of the
+    bond graph: every bonded atom is placed at the minimum image of its
+    parent atom in the tree. All atoms at the same depth of the trees
+    are moved at once, so one frame takes as many vectorized steps as
+    the longest molecule is deep.
+
+    Attributes
+    ----------
+    pbc_style : string
+        "whole", "mol", "res", "atom" or "nojump"
+
+    Methods
+    -------
+    __call__(ts)
+        Apply the transformation to a timestep.
+    """
+
+    def __init__(self, atoms, pbc_style):
+        """
+        Parameters
+        ----------
+        atoms : MDAnalysis AtomGroup
+            All atoms of the universe
+        pbc_style : string
+            Gromacs pbc definition: "whole" (make molecules whole),
+            "mol" (whole molecules with their center of mass in the
+            box), "res" (as mol, but for residues), "atom" (all atoms
+            in the box) or "nojump" (no jumps of atoms over the box
+            boundaries relative to the first frame read)
+
+        Raises
+        ------
+        NotImplementedError
+            If an unspecified pbc_style is choosen
+        ValueError
+            If molecules have to be made whole but atoms has no bonds
+        """
+        if pbc_style not in ("whole", "mol", "res", "atom", "nojump"):
+            raise NotImplementedError(
+                "{:s} is unspecified pbc_style".format(pbc_style)
+            )
+        self.pbc_style = pbc_style
+
+        if pbc_style in ("whole", "mol", "res"):
+            try:
+                bonds = atoms.bonds.indices
+            except AttributeError:
+                raise ValueError(
+                    "pbc_style {:s} needs a topology with bonds".format(pbc_style)
+                )
+            self._tree_levels, molecules = self._get_tree_levels(
+                len(atoms), bonds
+            )
+
+            if pbc_style == "mol":
+                self._groups = molecules
+            elif pbc_style == "res":
+                self._groups = atoms.resindices
+            if pbc_style != "whole":
+                self._masses = atoms.masses.astype(np.float64)
+                self._group_masses = np.bincount(self._groups,
+                                                 weights=self._masses)
+
+        self._previous_frame = None
+        self._previous_positions = None
+
+    def __call__(self, ts):
+        """Apply the transformation to a timestep
+
+        Parameters
+        ----------
+        ts : MDAnalysis Timestep
+
+        Returns
+        -------
+        ts : MDAnalysis Timestep
+            The same timestep with transformed positions
+        """
+        box_vectors = mdamath.triclinic_vectors(ts.dimensions)
+        inverse_box = np.linalg.inv(box_vectors)
+        positions = ts.positions.astype(np.float64)
+
+        if self.pbc_style in ("whole", "mol", "res"):
+            for children, parents in self._tree_levels:
+                positions[children] = positions[parents] + self._minimum_image(
+                    positions[children] - positions[parents],
+                    box_vectors, inverse_box
+                )
+
+            if self.pbc_style != "whole":
+                # Put the center of mass of every group into the box
+                centers = np.column_stack([
+                    np.bincount(self._groups,
+                                weights=self._masses * positions[:, dim])
+                    for dim in range(3)
+                ]) / self._group_masses[:, np.newaxis]
+                shifts = (self._wrap(centers, box_vectors, inverse_box)
+                          - centers)
+                positions += shifts[self._groups]
+
+        elif self.pbc_style == "atom":
+            positions = self._wrap(positions, box_vectors, inverse_box)
+
+        elif self.pbc_style == "nojump":
+            # Start again if the trajectory is read from the beginning
+            if (self._previous_frame is not None
+                    and ts.frame > self._previous_frame):
+                positions = self._previous_positions + self._minimum_image(
+                    positions - self._previous_positions,
+                    box_vectors, inverse_box
+                )
+            self._previous_frame = ts.frame
+            self._previous_positions = positions
+
+        ts.positions = positions
+
+        return ts
+
+    def _get_tree_levels(self, n_atoms, bonds):
+        """Get breadth-first spanning trees of all molecules, level by
+        level
+
+        Parameters
+        ----------
+        n_atoms : integer
+        bonds : numpy array(m,2) of int
+
+        Returns
+        -------
+        tree_levels : list of (numpy array of int, numpy array of int)
+            Atoms at each depth of the trees and their parent atoms
+        molecules : numpy array(n_atoms) of int
+            Molecule (connected component of the bond graph) of each
+            atom
+        """
+        adjacency = scipy.sparse.coo_matrix(
+            (np.ones(len(bonds), dtype=np.int8), (bonds[:, 0], bonds[:, 1])),
+            shape=(n_atoms, n_atoms),
+        )
+        adjacency = (adjacency + adjacency.T).tocsr()
+        _, molecules = scipy.sparse.csgraph.connected_components(
+            adjacency, directed=False
+        )
+
+        # The first atom of every molecule is the root of its tree
+        visited = np.zeros(n_atoms, dtype=bool)
+        frontier = np.unique(molecules, return_index=True)[1]
+        visited[frontier] = True
+
+        tree_levels = []
+        while frontier.size > 0:
+            neighbours = adjacency[frontier].tocoo()
+            parents = frontier[neighbours.row]
+            children = neighbours.col
+
+            unvisited = ~visited[children]
+            children, first = np.unique(children[unvisited], return_index=True)
+            parents = parents[unvisited][first]
+            if children.size == 0:
+                break
+
+            visited[children] = True
+            tree_levels.append((children, parents))
+            frontier = children
+
+        return tree_levels, molecules
+
+    def _minimum_image(self, vectors, box_vectors, inverse_box):
+        """Get the minimum image of vectors in fractional coordinates
+
+        Parameters
+        ----------
+        vectors : numpy array(n,3)
+        box_vectors : numpy array(3,3)
+        inverse_box : numpy array(3,3)
+
+        Returns
+        -------
+        vectors : numpy array(n,3)
+        """
+        fractional = np.matmul(vectors, inverse_box)
+        fractional -= np.round(fractional)
+
+        return np.matmul(fractional, box_vectors)
+
+    def _wrap(self, positions, box_vectors, inverse_box):
+        """Wrap positions into the primary unit cell
+
+        Parameters
+        ----------
+        positions : numpy array(n,3)
+        box_vectors : numpy array(3,3)
+        inverse_box : numpy array(3,3)
+
+        Returns
+        -------
+        positions : numpy array(n,3)
+        """
+        fractional = np.matmul(positions, inverse_box)
+        fractional -= np.floor(fractional)
+
+        return np.matmul(fractional, box_vectors)
@@ -0,0 +1,263 @@
+import os
+import numpy as np
+
+
+class StructureFactorAccumulator():
+    """Running average of the structure factor binned by the modulus
+    of the wave vector
+
+    Every frame only adds to the sums, counts and sums of squares of
+    the bins, so the memory does not grow with the number of frames.
+    The raw values of every wave vector are only kept if asked for,
+    either in memory, in buffers that double their capacity when full,
+    or appended to a .npy file that is memory mapped at the end.
+
+    Attributes
+    ----------
+    bin_edges : numpy array(n_bins+1)
+    bin_centers : numpy array(n_bins)
+    sums : numpy array(n_bins)
+        Sum of S(q) of all wave vectors in each bin
+    sums_of_squares : numpy array(n_bins)
+        Sum of S(q)^2 of all wave vectors in each bin
+    counts : numpy array(n_bins) of int
+        Number of wave vectors in each bin, counting their weights
+    q_array : numpy array(n,3) or None
+        Raw wave vectors, set by close if raw is not False
+    q_norm : numpy array(n) or None
+        Raw moduli of the wave vectors
+    Sq : numpy array(n) or None
+        Raw structure factors
+    q_weights : numpy array(n) or None
+        Raw multiplicities of the wave vectors
+
+    Methods
+    -------
+    add(q_array, q_norm, Sq, q_weights=None)
+        Add the structure factor of one frame.
+    get_mean()
+        Mean S(q) of each bin.
+    get_error()
+        Standard error of the mean S(q) of each bin.
+    close()
+        Finish the raw output.
+    """
+
+    def __init__(self, q_min, q_max, n_bins, raw=False, overwrite=False):
+        """
+        Parameters
+        ----------
+        q_min : float
+            Lower edge of the first bin
+        q_max : float
+            Upper edge of the last bin, q_max itself is in the last bin
+        n_bins : integer
+        raw : bool or string, optional
+            False to only keep the bins, True to keep the raw values in
+            memory or the path of a .npy file the raw values are written
+            to, by default False. The file holds a one dimensional
+            structured array that can be read with numpy.load, one
+            record per wave vector and frame with the fields q
+            (3 floats), q_norm (float), Sq (float) and q_weight (int8),
+            the float types are the ones of the values added.
+        overwrite : bool, optional
+            Overwrite the file raw if it exists, by default False
+
+        Raises
+        ------
+        FileExistsError
+            If raw is the path of an existing file and overwrite is
+            False
+        """
+        if (raw is not False and raw is not True and not overwrite
+                and os.path.exists(raw)):
+            raise FileExistsError(
+                "{:s} exists and is not overwritten".format(raw)
+            )
+
+        self.bin_edges = np.linspace(q_min, q_max, n_bins + 1)
+        self.bin_centers = 0.5 * (self.bin_edges[:-1] + self.bin_edges[1:])
+        self.sums = np.zeros(n_bins)
+        self.sums_of_squares = np.zeros(n_bins)
+        self.counts = np.zeros(n_bins, dtype=np.int64)
+
+        self.raw = raw
+        self.q_array = None
+        self.q_norm = None
+        self.Sq = None
+        self.q_weights = None
+
+        self._q_min = q_min
+        self._bin_width = (q_max - q_min) / n_bins
+        self._n_bins = n_bins
+        self._raw_dtype = None
+        self._raw_buffer = None
+        self._raw_size = 0
+        self._raw_file = None
+
+    def add(self, q_array, q_norm, Sq, q_weights=None):
+        """Add the structure factor of one frame
+
+        Parameters
+        ----------
+        q_array : numpy array(m,3)
+        q_norm : numpy array(m)
+        Sq : numpy array(m)
+        q_weights : numpy array(m) of int, optional
+            Multiplicity of each wave vector, e.g. 2 if S(-q) = S(q)
+            is not listed separately, by default 1
+        """
+        if q_weights is None:
+            q_weights = np.ones(len(q_norm), dtype=int)
+
+        bins = np.floor((q_norm - self._q_min) / self._bin_width).astype(int)
+        # q_max belongs to the last bin, values outside are not binned
+        bins[q_norm == self.bin_edges[-1]] = self._n_bins - 1
+        inside = (bins >= 0) & (bins < self._n_bins)
+        bins = bins[inside]
+        Sq_inside = np.asarray(Sq, dtype=np.float64)[inside]
+        weights_inside = q_weights[inside]
+
+        self.sums += np.bincount(bins, weights=weights_inside * Sq_inside,
+                                 minlength=self._n_bins)
+        self.sums_of_squares += np.bincount(
+            bins, weights=weights_inside * Sq_inside**2, minlength=self._n_bins
+        )
+        self.counts += np.bincount(bins, weights=weights_inside,
+                                   minlength=self._n_bins).astype(np.int64)
+
+        if self.raw is not False:
+            self._add_raw(q_array, q_norm, Sq, q_weights)
+
+    def get_mean(self):
+        """Get the mean S(q) of each bin, empty bins are 0
+
+        Returns
+        -------
+        bin_centers : numpy array(n_bins)
+        mean : numpy array(n_bins)
+        """
+        return self.bin_centers, self.sums / np.maximum(self.counts, 1)
+
+    def get_error(self):
+        """Get the standard error of the mean S(q) of each bin, bins with
+        less than two values are 0
+
+        Returns
+        -------
+        error : numpy array(n_bins)
+        """
+        counts = np.maximum(self.counts, 1)
+        mean = self.sums / counts
+        variance = np.maximum(self.sums_of_squares / counts - mean**2, 0.0)
+        error = np.sqrt(variance / np.maximum(self.counts - 1, 1))
+        error[self.counts < 2] = 0.0
+
+        return error
+
+    def close(self):
+        """Finish the raw output and set q_array, q_norm, Sq and
+        q_weights
+
+        The raw values are copied into contiguous arrays if they are
+        kept in memory, or memory mapped read-only from the file.
+        """
+        if self.raw is False or self._raw_dtype is None:
+            return
+
+        if self._raw_file is not None:
+            # The final number of records is only known now
+            self._raw_file.seek(0)
+            self._raw_file.write(self._get_npy_header(self._raw_size))
+            self._raw_file.close()
+            self._raw_file = None
+            records = np.load(self.raw, mmap_mode="r")
+            self.q_array = records["q"]
+            self.q_norm = records["q_norm"]
+            self.Sq = records["Sq"]
+            self.q_weights = records["q_weight"]
+        else:
+            records = self._raw_buffer[:self._raw_size]
+            self.q_array = np.ascontiguousarray(records["q"])
+            self.q_norm = np.ascontiguousarray(records["q_norm"])
+            self.Sq = np.ascontiguousarray(records["Sq"])
+            self.q_weights = np.ascontiguousarray(records["q_weight"])
+            self._raw_buffer = None
+
+    def _add_raw(self, q_array, q_norm, Sq, q_weights):
+        """Append the raw values of one frame to the buffer or file
+
+        Parameters
+        ----------
+        q_array : numpy array(m,3)
+        q_norm : numpy array(m)
+        Sq : numpy array(m)
+        q_weights : numpy array(m) of int
+        """
+        if self._raw_dtype is None:
+            self._raw_dtype = np.dtype([
+                ("q", np.asarray(q_array).dtype, (3,)),
+                ("q_norm", np.asarray(q_norm).dtype),
+                ("Sq", np.asarray(Sq).dtype),
+                ("q_weight", np.int8),
+            ])
+            if self.raw is True:
+                self._raw_buffer = np.empty(len(q_norm), dtype=self._raw_dtype)
+            else:
+                self._raw_file = open(self.raw, "wb")
+                # Reserve the header, it is written with the real shape
+                # by close
+                self._raw_file.write(self._get_npy_header(0))
+
+        records = np.empty(len(q_norm), dtype=self._raw_dtype)
+        records["q"] = q_array
+        records["q_norm"] = q_norm
+        records["Sq"] = Sq
+        records["q_weight"] = q_weights
+
+        if self._raw_file is not None:
+            records.tofile(self._raw_file)
+        else:
+            # Double the capacity, so every value is copied O(1) times
+            if self._raw_size + len(records) > len(self._raw_buffer):
+                capacity = max(2 * len(self._raw_buffer),
+                               self._raw_size + len(records))
+                buffer = np.empty(capacity, dtype=self._raw_dtype)
+                buffer[:self._raw_size] = self._raw_buffer[:self._raw_size]
+                self._raw_buffer = buffer
+            self._raw_buffer[self._raw_size:self._raw_size + len(records)] = records
+
+        self._raw_size += len(records)
+
+    def _get_npy_header(self, n_records):
+        """Get the .npy header of the raw output file
+
+        The header is padded to the length needed for the largest
+        possible number of records, so the placeholder written first
+        can be replaced in place by close.
+
+        Parameters
+        ----------
+        n_records : integer
+
+        Returns
+        -------
+        header : bytes
+        """
+        def header_dict(n):
+            return repr({
+                "descr": np.lib.format.dtype_to_descr(self._raw_dtype),
+                "fortran_order": False,
+                "shape": (n,),
+            })
+
+        # Magic string, version 1.0 and the header length take 10 bytes,
+        # the data starts at a multiple of 64 bytes
+        header_length = len(header_dict(np.iinfo(np.int64).max)) + 1
+        header_length += -(10 + header_length) % 64
+
+        header = header_dict(n_records).ljust(header_length - 1) + "\n"
+
+        return (np.lib.format.magic(1, 0)
+                + np.array(header_length, dtype="<u2").tobytes()
+                + header.encode("latin1"))
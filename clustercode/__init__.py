@@ -1,3 +1,4 @@
 from .ClusterEnsemble import ClusterEnsemble
+from .ClusterTrajectory import ClusterTrajectory
 from .OrderParameterEnsemble import OrderParameterEnsemble
-
+from .AnalysisPipeline import AnalysisPipeline